@@ -10,6 +10,7 @@ from the database each time an alert is sent.
 """
 
 from typing import Dict, Iterable, Optional, Any, Set, List
+from itertools import starmap
 from irisett.sql import DBConnection, Cursor
 from irisett import (
     errors,
@@ -19,9 +20,23 @@ from irisett.object_exists import (
     contact_exists,
     active_monitor_exists,
     contact_group_exists,
+    invalidate_exists,
+    bulk_exists,
 )
 
 
+# Bumped whenever contacts or the links between contacts and monitors
+# change. Code caching contact lookups compares against this value to
+# detect stale data.
+cache_generation = 0
+
+
+def invalidate_cache() -> None:
+    """Invalidate cached contact lookups."""
+    global cache_generation
+    cache_generation += 1
+
+
 async def create_contact(
     dbcon: DBConnection,
     name: Optional[str],
@@ -54,6 +69,7 @@ async def update_contact(
         q_args = (value, contact_id)
         queries.append((q, q_args))
     await dbcon.multi_operation(queries)
+    invalidate_cache()
 
 
 async def delete_contact(dbcon: DBConnection, contact_id: int) -> None:
@@ -62,6 +78,8 @@ async def delete_contact(dbcon: DBConnection, contact_id: int) -> None:
         raise errors.InvalidArguments("contact does not exist")
     q = """delete from contacts where id=%s"""
     await dbcon.operation(q, (contact_id,))
+    invalidate_exists(dbcon, "contacts", [contact_id])
+    invalidate_cache()
 
 
 async def create_contact_group(dbcon: DBConnection, name: str, active: bool) -> int:
@@ -89,6 +107,7 @@ async def update_contact_group(
         q_args = (value, contact_group_id)
         queries.append((q, q_args))
     await dbcon.multi_operation(queries)
+    invalidate_cache()
 
 
 async def delete_contact_group(dbcon: DBConnection, contact_group_id: int) -> None:
@@ -97,6 +116,8 @@ async def delete_contact_group(dbcon: DBConnection, contact_group_id: int) -> No
         raise errors.InvalidArguments("contact group does not exist")
     q = """delete from contact_groups where id=%s"""
     await dbcon.operation(q, (contact_group_id,))
+    invalidate_exists(dbcon, "contact_groups", [contact_group_id])
+    invalidate_cache()
 
 
 async def get_all_contacts_for_active_monitor(
@@ -212,13 +233,17 @@ async def add_contact_to_active_monitor(
     dbcon: DBConnection, contact_id: int, monitor_id: int
 ) -> None:
     """Connect a contact and an active monitor."""
-    if not await active_monitor_exists(dbcon, monitor_id):
+    monitor_found, contact_found = await bulk_exists(
+        dbcon, [("active_monitors", monitor_id), ("contacts", contact_id)]
+    )
+    if not monitor_found:
         raise errors.InvalidArguments("monitor does not exist")
-    if not await contact_exists(dbcon, contact_id):
+    if not contact_found:
         raise errors.InvalidArguments("contact does not exist")
     q = """replace into active_monitor_contacts (active_monitor_id, contact_id) values (%s, %s)"""
     q_args = (monitor_id, contact_id)
     await dbcon.operation(q, q_args)
+    invalidate_cache()
 
 
 async def delete_contact_from_active_monitor(
@@ -228,6 +253,7 @@ async def delete_contact_from_active_monitor(
     q = """delete from active_monitor_contacts where active_monitor_id=%s and contact_id=%s"""
     q_args = (monitor_id, contact_id)
     await dbcon.operation(q, q_args)
+    invalidate_cache()
 
 
 async def set_active_monitor_contacts(
@@ -249,6 +275,7 @@ async def set_active_monitor_contacts(
         q_args = (monitor_id, contact_id)
         queries.append((q, q_args))
     await dbcon.multi_operation(queries)
+    invalidate_cache()
 
 
 async def get_contacts_for_active_monitor(
@@ -263,9 +290,8 @@ async def get_contacts_for_active_monitor(
         from active_monitor_contacts, contacts
         where active_monitor_contacts.active_monitor_id = %s
         and active_monitor_contacts.contact_id = contacts.id"""
-    contacts = [
-        object_models.Contact(*row) for row in await dbcon.fetch_all(q, (monitor_id,))
-    ]
+    rows = await dbcon.fetch_all(q, (monitor_id,))
+    contacts = list(starmap(object_models.Contact, rows))
     return contacts
 
 
@@ -273,13 +299,17 @@ async def add_contact_group_to_active_monitor(
     dbcon: DBConnection, contact_group_id: int, monitor_id: int
 ) -> None:
     """Connect a contact group and an active monitor."""
-    if not await active_monitor_exists(dbcon, monitor_id):
+    monitor_found, contact_group_found = await bulk_exists(
+        dbcon, [("active_monitors", monitor_id), ("contact_groups", contact_group_id)]
+    )
+    if not monitor_found:
         raise errors.InvalidArguments("monitor does not exist")
-    if not await contact_group_exists(dbcon, contact_group_id):
+    if not contact_group_found:
         raise errors.InvalidArguments("contact does not exist")
     q = """replace into active_monitor_contact_groups (active_monitor_id, contact_group_id) values (%s, %s)"""
     q_args = (monitor_id, contact_group_id)
     await dbcon.operation(q, q_args)
+    invalidate_cache()
 
 
 async def delete_contact_group_from_active_monitor(
@@ -289,6 +319,7 @@ async def delete_contact_group_from_active_monitor(
     q = """delete from active_monitor_contact_groups where active_monitor_id=%s and contact_group_id=%s"""
     q_args = (monitor_id, contact_group_id)
     await dbcon.operation(q, q_args)
+    invalidate_cache()
 
 
 async def set_active_monitor_contact_groups(
@@ -309,6 +340,7 @@ async def set_active_monitor_contact_groups(
         q_args = (monitor_id, contact_group_id)
         queries.append(q, q_args)
     await dbcon.multi_operation(queries)
+    invalidate_cache()
 
 
 async def get_contact_groups_for_active_monitor(
@@ -320,16 +352,14 @@ async def get_contact_groups_for_active_monitor(
         from active_monitor_contact_groups, contact_groups
         where active_monitor_contact_groups.active_monitor_id = %s
         and active_monitor_contact_groups.contact_group_id = contact_groups.id"""
-    return [
-        object_models.ContactGroup(*row)
-        for row in await dbcon.fetch_all(q, (monitor_id,))
-    ]
+    rows = await dbcon.fetch_all(q, (monitor_id,))
+    return list(starmap(object_models.ContactGroup, rows))
 
 
 async def get_all_contacts(dbcon: DBConnection) -> Iterable[object_models.Contact]:
     """Get all contacts"""
     q = """select id, name, email, phone, active from contacts"""
-    return [object_models.Contact(*row) for row in await dbcon.fetch_all(q)]
+    return list(starmap(object_models.Contact, await dbcon.fetch_all(q)))
 
 
 async def get_contact(
@@ -352,20 +382,25 @@ async def get_contacts_for_metadata(
         from contacts as c, object_metadata as meta
         where meta.key=%s and meta.value=%s and meta.object_type="contact" and meta.object_id=c.id"""
     q_args = (meta_key, meta_value)
-    return [object_models.Contact(*row) for row in await dbcon.fetch_all(q, q_args)]
+    rows = await dbcon.fetch_all(q, q_args)
+    return list(starmap(object_models.Contact, rows))
 
 
 async def add_contact_to_contact_group(
     dbcon: DBConnection, contact_group_id: int, contact_id: int
 ) -> None:
     """Connect a contact and a contact group."""
-    if not await contact_group_exists(dbcon, contact_group_id):
+    contact_group_found, contact_found = await bulk_exists(
+        dbcon, [("contact_groups", contact_group_id), ("contacts", contact_id)]
+    )
+    if not contact_group_found:
         raise errors.InvalidArguments("contact group does not exist")
-    if not await contact_exists(dbcon, contact_id):
+    if not contact_found:
         raise errors.InvalidArguments("contact does not exist")
     q = """replace into contact_group_contacts (contact_group_id, contact_id) values (%s, %s)"""
     q_args = (contact_group_id, contact_id)
     await dbcon.operation(q, q_args)
+    invalidate_cache()
 
 
 async def delete_contact_from_contact_group(
@@ -375,6 +410,7 @@ async def delete_contact_from_contact_group(
     q = """delete from contact_group_contacts where contact_group_id=%s and contact_id=%s"""
     q_args = (contact_group_id, contact_id)
     await dbcon.operation(q, q_args)
+    invalidate_cache()
 
 
 async def set_contact_group_contacts(
@@ -395,6 +431,7 @@ async def set_contact_group_contacts(
         q_args = (contact_group_id, contact_id)
         queries.append(q, q_args)
     await dbcon.multi_operation(queries)
+    invalidate_cache()
 
 
 async def get_contacts_for_contact_group(
@@ -406,19 +443,15 @@ async def get_contacts_for_contact_group(
         from contact_group_contacts, contacts
         where contact_group_contacts.contact_group_id = %s
         and contact_group_contacts.contact_id = contacts.id"""
-    return [
-        object_models.Contact(*row)
-        for row in await dbcon.fetch_all(q, (contact_group_id,))
-    ]
+    rows = await dbcon.fetch_all(q, (contact_group_id,))
+    return list(starmap(object_models.Contact, rows))
 
 
 async def get_all_contact_groups(
     dbcon: DBConnection,
 ) -> Iterable[object_models.ContactGroup]:
     q = """select id, name, active from contact_groups"""
-    contact_groups = [
-        object_models.ContactGroup(*row) for row in await dbcon.fetch_all(q)
-    ]
+    contact_groups = list(starmap(object_models.ContactGroup, await dbcon.fetch_all(q)))
     return contact_groups
 
 
@@ -444,6 +477,5 @@ async def get_contact_groups_for_metadata(
         from contact_groups as cg, object_metadata as meta
         where meta.key=%s and meta.value=%s and meta.object_type="contact_group" and meta.object_id=cg.id"""
     q_args = (meta_key, meta_value)
-    return [
-        object_models.ContactGroup(*row) for row in await dbcon.fetch_all(q, q_args)
-    ]
+    rows = await dbcon.fetch_all(q, q_args)
+    return list(starmap(object_models.ContactGroup, rows))
@@ -132,6 +132,17 @@ class EventTracer:
             stats.dec("num_listeners", "EVENT")
             self.listeners.remove(listener)
 
+    def has_listeners(self, event_name: str) -> bool:
+        """Check if any listener is interested in an event.
+
+        Callers can use this to avoid building event arguments for events
+        that no one is listening for.
+        """
+        for listener in self.listeners:
+            if not listener.event_filter or event_name in listener.event_filter:
+                return True
+        return False
+
     def running(self, event_name: str, **kwargs: Any) -> None:
         """An event is running.
 
@@ -155,4 +166,5 @@ class EventTracer:
 default_tracer = EventTracer()
 listen = default_tracer.listen
 stop_listening = default_tracer.stop_listening
+has_listeners = default_tracer.has_listeners
 running = default_tracer.running
@@ -71,10 +71,28 @@ def msg(logmsg: str, section: Optional[str] = None) -> None:
 err = msg
 
 
+def msg_enabled() -> bool:
+    """Check if standard messages will be logged.
+
+    Use this to skip formatting messages that would be discarded.
+    """
+    global logger
+    return bool(logger and logger.isEnabledFor(logging.INFO))
+
+
+def debug_enabled() -> bool:
+    """Check if debug messages will be logged.
+
+    Use this to skip formatting debug messages that would be discarded.
+    """
+    global logger
+    return bool(logger and logger.isEnabledFor(logging.DEBUG))
+
+
 def debug(logmsg: str, section: Optional[str] = None) -> None:
     """Log a debug message."""
     global logger
-    if not logger:
+    if not logger or not logger.isEnabledFor(logging.DEBUG):
         return
     if section:
         logmsg = "[%s] %s" % (section, logmsg)
@@ -88,4 +106,5 @@ class LoggingMixin:
         msg("%s %s" % (str(self), logmsg))
 
     def log_debug(self, logmsg: str) -> None:
-        debug("%s %s" % (str(self), logmsg))
+        if debug_enabled():
+            debug("%s %s" % (str(self), logmsg))
@@ -75,18 +75,40 @@ async def mainloop(
         await asyncio.sleep(10)
 
 
+def install_uvloop() -> None:
+    """Use uvloop for the asyncio event loop if it is available.
+
+    This must be called before any component grabs the event loop.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        log.msg("uvloop requested but not installed, using the default event loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    log.debug("Using uvloop event loop")
+
+
 def init_database(config: configparser.ConfigParser) -> sql.DBConnection:
     dbcon = None
     if "type" not in config or config["type"] == "mysql":
         import irisett.sql.db_mysql
 
         dbcon = irisett.sql.db_mysql.DBConnection(
-            config["host"], config["username"], config["password"], config["dbname"]
+            config["host"],
+            config["username"],
+            config["password"],
+            config["dbname"],
+            pool_minsize=int(config.get("pool-minsize", fallback="5")),
+            pool_maxsize=int(config.get("pool-maxsize", fallback="20")),
         )
     elif config["type"] == "sqlite":
         import irisett.sql.db_sqlite
 
-        dbcon = irisett.sql.db_sqlite.DBConnection(config["filename"])
+        dbcon = irisett.sql.db_sqlite.DBConnection(
+            config["filename"],
+            read_pool_size=int(config.get("read-pool-size", fallback="4")),
+        )
     else:
         log.msg("Invalid DB type %s" % (config["type"]))
     return dbcon
@@ -105,6 +127,8 @@ def main() -> None:
     )
     if debug_mode:
         log.debug("Debug mode enabled")
+    if config.getboolean("DEFAULT", "uvloop", fallback=False):
+        install_uvloop()
     dbcon = init_database(config["DATABASE"])
     if not dbcon:
         return
@@ -122,5 +146,9 @@ def main() -> None:
         debug_mode=debug_mode,
     )
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(mainloop(loop, config, dbcon, active_monitor_manager))
-    loop.close()
+    try:
+        loop.run_until_complete(mainloop(loop, config, dbcon, active_monitor_manager))
+    finally:
+        loop.run_until_complete(notification_manager.close())
+        loop.run_until_complete(dbcon.close())
+        loop.close()
@@ -6,9 +6,20 @@ of (short) data that are attached to an object.
 """
 
 from typing import Dict, Iterable, Optional, Tuple
+from itertools import starmap
 from irisett.sql import DBConnection, Cursor
 from irisett import object_models
 
+# Bumped whenever any metadata changes. Code caching metadata lookups
+# compares against this value to detect stale data.
+cache_generation = 0
+
+
+def invalidate_cache() -> None:
+    """Invalidate cached metadata lookups."""
+    global cache_generation
+    cache_generation += 1
+
 
 async def get_metadata(
     dbcon: DBConnection, object_type: str, object_id: int
@@ -38,6 +49,7 @@ async def add_metadata(
             await cur.execute(q, q_args)
 
     await dbcon.transact(_run)
+    invalidate_cache()
 
 
 async def update_metadata(
@@ -59,6 +71,7 @@ async def update_metadata(
             await cur.execute(q, q_args)
 
     await dbcon.transact(_run)
+    invalidate_cache()
 
 
 async def delete_metadata(
@@ -86,6 +99,7 @@ async def delete_metadata(
             await cur.execute(q, q_args)
 
     await dbcon.transact(_run)
+    invalidate_cache()
 
 
 async def get_metadata_for_object(
@@ -99,9 +113,8 @@ async def get_metadata_for_object(
         from object_metadata as metadata
         where metadata.object_type=%s and metadata.object_id=%s"""
     q_args = (object_type, object_id)
-    return [
-        object_models.ObjectMetadata(*row) for row in await dbcon.fetch_all(q, q_args)
-    ]
+    rows = await dbcon.fetch_all(q, q_args)
+    return list(starmap(object_models.ObjectMetadata, rows))
 
 
 async def get_metadata_for_object_type(
@@ -114,10 +127,8 @@ async def get_metadata_for_object_type(
     q = """select metadata.object_type, metadata.object_id, metadata.key, metadata.value
         from object_metadata as metadata
         where metadata.object_type=%s"""
-    return [
-        object_models.ObjectMetadata(*row)
-        for row in await dbcon.fetch_all(q, (object_type,))
-    ]
+    rows = await dbcon.fetch_all(q, (object_type,))
+    return list(starmap(object_models.ObjectMetadata, rows))
 
 
 async def get_metadata_for_object_metadata(
@@ -142,6 +153,5 @@ async def get_metadata_for_object_metadata(
         object_table,
     )
     q_args = (metadata_key, metadata_value, object_type)
-    return [
-        object_models.ObjectMetadata(*row) for row in await dbcon.fetch_all(q, q_args)
-    ]
+    rows = await dbcon.fetch_all(q, q_args)
+    return list(starmap(object_models.ObjectMetadata, rows))
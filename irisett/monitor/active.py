@@ -8,12 +8,14 @@ A monitor managed is used for scheduling monitor service checks and starting
 each check.
 """
 
-from typing import Dict, Any, List, Union, Optional, Iterator, Tuple, cast
+from typing import Dict, Any, List, Union, Optional, Iterator, Tuple, Set, Callable
 import time
 import random
+import re
 import jinja2
 import shlex
 import asyncio
+from collections import defaultdict
 
 from irisett import (
     log,
@@ -24,28 +26,51 @@ from irisett import (
     stats,
     event,
     object_models,
+    metadata,
     sql,
 )
 from irisett.monitor import active_sql
 
-from irisett.metadata import get_metadata
 from irisett.notify.manager import NotificationManager
 from irisett.sql import DBConnection
 
 UNKNOWN_THRESHOLD = 5
+# Max age in seconds of cached notification contacts/metadata.
+NOTIFY_CACHE_TTL = 300
 
+_SIMPLE_TMPL_VAR_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
 
-async def load_monitor_defs(
+
+def compile_template(tmpl: str) -> Callable[[Dict[str, Any]], str]:
+    """Compile a monitor def template into a render function.
+
+    Most templates only do plain {{var}} substitution, those are expanded
+    using a regexp which is a lot cheaper than a jinja render. Templates
+    using any other jinja features are rendered using jinja.
+    """
+    if "{%" in tmpl or "{#" in tmpl or "{{" in _SIMPLE_TMPL_VAR_RE.sub("", tmpl):
+        jinja_tmpl = jinja2.Template(tmpl)
+        return lambda args: jinja_tmpl.render(**args)
+    # Match jinjas default behaviour of dropping a single trailing newline.
+    if tmpl.endswith("\n"):
+        tmpl = tmpl[:-1]
+
+    def _render(args: Dict[str, Any]) -> str:
+        return _SIMPLE_TMPL_VAR_RE.sub(lambda m: str(args.get(m.group(1), "")), tmpl)
+
+    return _render
+
+
+def load_monitor_defs(
     manager: "ActiveMonitorManager",
+    def_models: List[Tuple[object_models.ActiveMonitorDef, List[object_models.ActiveMonitorDefArg]]],
 ) -> Dict[int, "ActiveMonitorDef"]:
     """Load all monitor definitions.
 
     Return a dict mapping def id to def instance.
     """
-    monitor_def_models = await active_sql.get_all_active_monitor_defs(manager.dbcon)
-    monitor_def_args_map = await map_monitor_def_args_to_monitor_defs(manager.dbcon)
     monitor_defs = {}
-    for monitor_def in monitor_def_models:
+    for monitor_def, args in def_models:
         monitor_defs[monitor_def.id] = ActiveMonitorDef(
             monitor_def.id,
             monitor_def.name,
@@ -53,40 +78,26 @@ async def load_monitor_defs(
             monitor_def.cmdline_filename,
             monitor_def.cmdline_args_tmpl,
             monitor_def.description_tmpl,
-            monitor_def_args_map.get(monitor_def.id, []),
+            args,
             manager,
         )
     return monitor_defs
 
 
-async def map_monitor_def_args_to_monitor_defs(
-    dbcon: DBConnection,
-) -> Dict[int, List[object_models.ActiveMonitorDefArg]]:
-    """Get active monitor def args and map them to active monitor defs.
-
-    List all arguments, return a dict that maps the arguments to monitor def ids.
-    """
-    ret = {}  # type: Dict[int, List[object_models.ActiveMonitorDefArg]]
-    for arg in await active_sql.get_all_active_monitor_def_args(dbcon):
-        if arg.active_monitor_def_id not in ret:
-            ret[arg.active_monitor_def_id] = []
-        ret[arg.active_monitor_def_id].append(arg)
-    return ret
-
-
-async def load_monitors(manager: "ActiveMonitorManager") -> Dict[int, "ActiveMonitor"]:
+def load_monitors(
+    manager: "ActiveMonitorManager", monitor_models: List[object_models.ActiveMonitor]
+) -> Dict[int, "ActiveMonitor"]:
     """Load all monitors.
 
-    Return a dict mapping monitor id to monitor instance.
+    Monitor defs must be loaded first. Return a dict mapping monitor id to
+    monitor instance.
     """
-    monitor_models = await active_sql.get_all_active_monitors(manager.dbcon)
-    monitor_args_map = await map_monitor_args_to_monitors(manager.dbcon)
     monitors = {}
     for monitor in monitor_models:
         monitor_def = manager.monitor_defs[monitor.def_id]
         monitors[monitor.id] = ActiveMonitor(
             monitor.id,
-            monitor_args_map.get(monitor.id, {}),
+            monitor.args,
             monitor_def,
             monitor.state,
             monitor.state_ts,
@@ -100,21 +111,6 @@ async def load_monitors(manager: "ActiveMonitorManager") -> Dict[int, "ActiveMon
     return monitors
 
 
-async def map_monitor_args_to_monitors(
-    dbcon: DBConnection,
-) -> Dict[int, Dict[str, str]]:
-    """Get active monitor args and map them to active monitors.
-
-    List all arguments, return a dict that maps the arguments to monitor ids.
-    """
-    ret = {}  # type: Dict[int, Dict[str, str]]
-    for arg in await active_sql.get_all_active_monitor_args(dbcon):
-        if arg.monitor_id not in ret:
-            ret[arg.monitor_id] = {}
-        ret[arg.monitor_id][arg.name] = arg.value
-    return ret
-
-
 class ActiveMonitorManager(log.LoggingMixin):
     """The manager and main loop for active monitors.
 
@@ -136,6 +132,10 @@ class ActiveMonitorManager(log.LoggingMixin):
         loop: asyncio.AbstractEventLoop = None
     ) -> None:
         self.loop = loop or asyncio.get_event_loop()
+        if hasattr(asyncio, "eager_task_factory"):
+            # Many monitor runs and notifications return before their first
+            # real suspension point, eager tasks lets them skip a loop trip.
+            self.loop.set_task_factory(asyncio.eager_task_factory)
         self.dbcon = dbcon
         self.notification_manager = notification_manager
         self.max_concurrent_jobs = max_concurrent_jobs
@@ -145,8 +145,22 @@ class ActiveMonitorManager(log.LoggingMixin):
         self.debug_mode = debug_mode
         if debug_mode:
             log.debug("Debug mode active, all monitors will be started immediately")
+        self._job_sem = asyncio.Semaphore(max_concurrent_jobs)
         self.monitor_defs = {}  # type: Dict[int, ActiveMonitorDef]
+        # Monitor defs indexed by name, see update_monitor_def_names.
+        self.monitor_defs_by_name = {}  # type: Dict[str, ActiveMonitorDef]
         self.monitors = {}  # type: Dict[int, ActiveMonitor]
+        # Monitor ids indexed by monitor def id.
+        self.monitors_by_def = defaultdict(set)  # type: Dict[int, Set[int]]
+        # Ids of monitors that currently lack a scheduled job, used by
+        # check_missing_schedules.
+        self._unscheduled = set()  # type: Set[int]
+        # Ids of monitors waiting for a free job slot.
+        self._waiting = set()  # type: Set[int]
+        # Scheduled monitor ids bucketed by the whole (loop time) second they
+        # are due to run. Each bucket has a single loop timer, this keeps
+        # the loop timer heap small with many monitors.
+        self._schedule_buckets = {}  # type: Dict[int, Set[int]]
         self.num_running_jobs = 0
         stats.set("total_jobs_run", 0, "ACT_MON")
         stats.set("cur_running_jobs", 0, "ACT_MON")
@@ -155,6 +169,14 @@ class ActiveMonitorManager(log.LoggingMixin):
         stats.set("checks_up", 0, "ACT_MON")
         stats.set("checks_down", 0, "ACT_MON")
         stats.set("checks_unknown", 0, "ACT_MON")
+        # Hot path counters, these are accumulated locally and flushed to
+        # the global stats periodically by flush_stats.
+        self.stats_counters = {
+            "total_jobs_run": 0,
+            "checks_up": 0,
+            "checks_down": 0,
+            "checks_unknown": 0,
+        }  # type: Dict[str, int]
 
     async def initialize(self) -> None:
         """Load all data required for the managed main loop to run.
@@ -162,19 +184,30 @@ class ActiveMonitorManager(log.LoggingMixin):
         This can't be called from __init__ as it is an async call.
         """
         await remove_deleted_monitors(self.dbcon)
-        self.monitor_defs = await load_monitor_defs(self)
-        self.monitors = await load_monitors(self)
+        def_models, monitor_models = await active_sql.get_all_active_monitor_data(
+            self.dbcon
+        )
+        self.monitor_defs = load_monitor_defs(self, def_models)
+        self.update_monitor_def_names()
+        self.monitors = load_monitors(self, monitor_models)
+        for monitor in self.monitors.values():
+            self.monitors_by_def[monitor.monitor_def.id].add(monitor.id)
         log.msg("Loaded %d active monitor definitions" % (len(self.monitor_defs)))
         log.msg("Loaded %d active monitors" % (len(self.monitors)))
 
     def start(self) -> None:
-        for monitor in self.monitors.values():
-            start_delay = 0
-            if not self.debug_mode:
-                start_delay = random.randint(1, self.default_monitor_interval)
+        monitors = list(self.monitors.values())
+        if self.debug_mode:
+            start_delays = [0] * len(monitors)
+        else:
+            # Spread the initial checks out over one monitor interval.
+            rand = random.Random().randint
+            interval = self.default_monitor_interval
+            start_delays = [rand(1, interval) for _ in monitors]
+        for monitor, start_delay in zip(monitors, start_delays):
             self.schedule_monitor(monitor, start_delay)
-        # self.scheduleMonitor(monitor, 0)
         self.check_missing_schedules()
+        self.flush_stats()
         if self.result_retention_period:
             self.loop.call_later(10, self.purge_monitor_results)
 
@@ -192,6 +225,15 @@ class ActiveMonitorManager(log.LoggingMixin):
     async def _purge_monitor_results(self, age) -> None:
         await active_sql.purge_active_monitor_results(self.dbcon, age)
 
+    def flush_stats(self) -> None:
+        """Flush locally accumulated counters to the global stats."""
+        self.loop.call_later(1, self.flush_stats)
+        for key, value in self.stats_counters.items():
+            if value:
+                stats.inc(key, "ACT_MON", value)
+                self.stats_counters[key] = 0
+        stats.set("cur_running_jobs", self.num_running_jobs, "ACT_MON")
+
     def check_missing_schedules(self) -> None:
         """Failsafe to check that no monitors are missing scheduled checks.
 
@@ -200,11 +242,15 @@ class ActiveMonitorManager(log.LoggingMixin):
         """
         log.debug("Running monitor missing schedule check")
         self.loop.call_later(600, self.check_missing_schedules)
-        for monitor in self.monitors.values():
+        for monitor_id in list(self._unscheduled):
+            monitor = self.monitors.get(monitor_id)
+            if not monitor or monitor.deleted:
+                self._unscheduled.discard(monitor_id)
+                continue
             if (
-                not monitor.deleted
-                and not monitor.monitoring
-                and not monitor.scheduled_job
+                not monitor.monitoring
+                and monitor.scheduled_job is None
+                and monitor_id not in self._waiting
             ):
                 log.msg(
                     "%s is missing scheduled job, this is probably a bug, scheduling now"
@@ -223,44 +269,85 @@ class ActiveMonitorManager(log.LoggingMixin):
     async def _run_monitor(self, monitor_id: int) -> None:
         monitor = self.monitors.get(monitor_id)
         if not monitor:
-            log.debug("Skipping scheduled job for missing monitor %s" % monitor_id)
+            if log.debug_enabled():
+                log.debug("Skipping scheduled job for missing monitor %s" % monitor_id)
             return None
         monitor.scheduled_job = None
-        if self.num_running_jobs > self.max_concurrent_jobs:
-            log.msg("Deferred monitor %s due to to many running jobs" % monitor)
-            self.schedule_monitor(monitor, random.randint(10, 30))
-            stats.inc("jobs_deferred", "ACT_MON")
+        self._unscheduled.add(monitor.id)
+        if monitor.id in self._waiting:
+            # Already waiting for a job slot.
             return None
-        self.num_running_jobs += 1
-        stats.inc("total_jobs_run", "ACT_MON")
-        stats.inc("cur_running_jobs", "ACT_MON")
+        if self._job_sem.locked():
+            stats.inc("jobs_deferred", "ACT_MON")
+            if len(self._waiting) >= self.max_concurrent_jobs:
+                # To many jobs are already waiting, try again later.
+                log.msg("Deferred monitor %s due to to many running jobs" % monitor)
+                self.schedule_monitor(monitor, random.randint(10, 30))
+                return None
+            # Wait for a free job slot, max_concurrent_jobs are already running.
+            if log.debug_enabled():
+                log.debug("Waiting to run monitor %s, to many running jobs" % monitor)
+        self._waiting.add(monitor.id)
         try:
-            await monitor.run()
-        except Exception as e:
-            stats.dec("cur_running_jobs", "ACT_MON")
-            self.num_running_jobs -= 1
-            log.msg("Monitor run raised error: %s" % (str(e)))
-            if not monitor.scheduled_job:
-                self.schedule_monitor(monitor, self.default_monitor_interval)
-            raise
-        self.num_running_jobs -= 1
-        stats.dec("cur_running_jobs", "ACT_MON")
+            await self._job_sem.acquire()
+        finally:
+            self._waiting.discard(monitor.id)
+        try:
+            if monitor.scheduled_job is not None or monitor.deleted:
+                # Rescheduled or deleted while waiting for a job slot.
+                return None
+            self.num_running_jobs += 1
+            self.stats_counters["total_jobs_run"] += 1
+            try:
+                await monitor.run()
+            except Exception as e:
+                log.msg("Monitor run raised error: %s" % (str(e)))
+                if monitor.scheduled_job is None:
+                    self.schedule_monitor(monitor, self.default_monitor_interval)
+                raise
+            finally:
+                self.num_running_jobs -= 1
+        finally:
+            self._job_sem.release()
 
     def schedule_monitor(self, monitor: "ActiveMonitor", interval: int) -> None:
-        log.debug("Scheduling %s for %ds" % (monitor, interval))
-        if monitor.scheduled_job:
-            try:
-                monitor.scheduled_job.cancel()
-            except ValueError:
-                pass
-        monitor.scheduled_job = self.loop.call_later(
-            interval, self.run_monitor, monitor.id
-        )
+        if log.debug_enabled():
+            log.debug("Scheduling %s for %ds" % (monitor, interval))
+        if monitor.scheduled_job is not None:
+            bucket = self._schedule_buckets.get(monitor.scheduled_job)
+            if bucket:
+                bucket.discard(monitor.id)
+        when = int(self.loop.time() + interval)
+        bucket = self._schedule_buckets.get(when)
+        if bucket is None:
+            bucket = self._schedule_buckets[when] = set()
+            self.loop.call_at(when, self.run_scheduled_bucket, when)
+        bucket.add(monitor.id)
+        monitor.scheduled_job = when
+        self._unscheduled.discard(monitor.id)
         monitor.scheduled_job_ts = time.time() + interval
-        event.running("SCHEDULE_ACTIVE_MONITOR", monitor=monitor, interval=interval)
+        if event.has_listeners("SCHEDULE_ACTIVE_MONITOR"):
+            event.running("SCHEDULE_ACTIVE_MONITOR", monitor=monitor, interval=interval)
+
+    def run_scheduled_bucket(self, when: int) -> None:
+        """Run all monitors scheduled for a whole second."""
+        for monitor_id in self._schedule_buckets.pop(when, ()):
+            self.run_monitor(monitor_id)
+
+    def update_monitor_def_names(self) -> None:
+        """Rebuild the monitor def name index.
+
+        Must be called whenever a monitor def is added, removed or renamed.
+        If several defs share a name the first one wins.
+        """
+        by_name = {}  # type: Dict[str, ActiveMonitorDef]
+        for monitor_def in self.monitor_defs.values():
+            by_name.setdefault(monitor_def.name, monitor_def)
+        self.monitor_defs_by_name = by_name
 
     def add_monitor(self, monitor: "ActiveMonitor") -> None:
         self.monitors[monitor.id] = monitor
+        self.monitors_by_def[monitor.monitor_def.id].add(monitor.id)
         self.schedule_monitor(monitor, 0)
 
 
@@ -277,27 +364,28 @@ class MonitorTemplateCache:
     """
 
     def __init__(self) -> None:
-        self.cache = {}  # type: Dict[int, Any]
+        self.cache = {}  # type: Dict[Tuple[int, str], Any]
+        # Cached value names per monitor id, used when flushing a monitor.
+        self.monitor_names = {}  # type: Dict[int, Set[str]]
 
     def get(self, monitor: "ActiveMonitor", name: str) -> Any:
-        ret = None
-        monitor_values = self.cache.get(monitor.id)
-        if monitor_values:
-            ret = monitor_values.get(name)
-        return ret
+        return self.cache.get((monitor.id, name))
 
     def set(self, monitor: "ActiveMonitor", name: str, value: Any) -> Any:
-        if monitor.id not in self.cache:
-            self.cache[monitor.id] = {}
-        self.cache[monitor.id][name] = value
+        self.cache[(monitor.id, name)] = value
+        names = self.monitor_names.get(monitor.id)
+        if names is None:
+            names = self.monitor_names[monitor.id] = set()
+        names.add(name)
         return value
 
     def flush_all(self) -> None:
         self.cache = {}
+        self.monitor_names = {}
 
     def flush_monitor(self, monitor: "ActiveMonitor") -> None:
-        if monitor.id in self.cache:
-            del self.cache[monitor.id]
+        for name in self.monitor_names.pop(monitor.id, ()):
+            self.cache.pop((monitor.id, name), None)
 
 
 class ActiveMonitorDef(log.LoggingMixin):
@@ -320,22 +408,28 @@ class ActiveMonitorDef(log.LoggingMixin):
         self.description_tmpl = description_tmpl
         self.arg_spec = arg_spec
         self.manager = manager
-        self.jinja_cmdline_args = jinja2.Template(cmdline_args_tmpl)
-        self.jinja_description_tmpl = jinja2.Template(description_tmpl)
+        self.render_cmdline_args = compile_template(cmdline_args_tmpl)
+        self.render_description = compile_template(description_tmpl)
         self.tmpl_cache = MonitorTemplateCache()
+        self._default_args = {}  # type: Dict[str, str]
+        self._arg_by_name = {}  # type: Dict[str, object_models.ActiveMonitorDefArg]
+        self._update_arg_cache()
 
     def __str__(self) -> str:
         return "<ActiveMonitorDef(%s/%s)>" % (self.id, self.cmdline_filename)
 
+    def _update_arg_cache(self) -> None:
+        """Rebuild values derived from arg_spec.
+
+        Must be called whenever arg_spec is changed.
+        """
+        self._default_args = {a.name: a.default_value for a in self.arg_spec}
+        self._arg_by_name = {a.name: a for a in self.arg_spec}
+
     def get_arg_with_name(
         self, name: str
     ) -> Optional[object_models.ActiveMonitorDefArg]:
-        match = None
-        for arg in self.arg_spec:
-            if arg.name == name:
-                match = arg
-                break
-        return match
+        return self._arg_by_name.get(name)
 
     def expand_monitor_args(self, monitor_args: Dict[str, str]) -> List[str]:
         """Expand the monitors command line arguments.
@@ -343,9 +437,8 @@ class ActiveMonitorDef(log.LoggingMixin):
         The monitor command line arguments are based on monitor def
         cmdline_args_tmpl template.
         """
-        args = {a.name: a.default_value for a in self.arg_spec}
-        args.update(monitor_args)
-        expanded = self.jinja_cmdline_args.render(**args)
+        args = {**self._default_args, **monitor_args}
+        expanded = self.render_cmdline_args(args)
         ret = shlex.split(expanded)  # Supports "" splitting etc.
         return ret
 
@@ -358,9 +451,8 @@ class ActiveMonitorDef(log.LoggingMixin):
 
         This is used when sending monitor notifications.
         """
-        args = {a.name: a.default_value for a in self.arg_spec}
-        args.update(monitor_args)
-        description = self.jinja_description_tmpl.render(**args)
+        args = {**self._default_args, **monitor_args}
+        description = self.render_description(args)
         return description
 
     def validate_monitor_args(
@@ -370,9 +462,8 @@ class ActiveMonitorDef(log.LoggingMixin):
             for arg in self.arg_spec:
                 if arg.required and arg.name not in monitor_args:
                     raise errors.InvalidArguments("missing argument %s" % arg.name)
-        arg_name_set = {a.name for a in self.arg_spec}
         for key, value in monitor_args.items():
-            if key not in arg_name_set:
+            if key not in self._arg_by_name:
                 raise errors.InvalidArguments("invalid argument %s" % key)
         return True
 
@@ -380,6 +471,7 @@ class ActiveMonitorDef(log.LoggingMixin):
         for _ in self.iter_monitors():
             raise errors.IrisettError("can't remove active monitor def that is in use")
         del self.manager.monitor_defs[self.id]
+        self.manager.update_monitor_def_names()
         self.tmpl_cache.flush_all()
         await active_sql.delete_active_monitor_def(self.manager.dbcon, self.id)
 
@@ -387,16 +479,17 @@ class ActiveMonitorDef(log.LoggingMixin):
         self.log_msg("updating monitor def")
         if "name" in update_params:
             self.name = update_params["name"]
+            self.manager.update_monitor_def_names()
         if "active" in update_params:
             self.active = update_params["active"]
         if "cmdline_filename" in update_params:
             self.cmdline_filename = update_params["cmdline_filename"]
         if "cmdline_args_tmpl" in update_params:
             self.cmdline_args_tmpl = update_params["cmdline_args_tmpl"]
-            self.jinja_cmdline_args = jinja2.Template(self.cmdline_args_tmpl)
+            self.render_cmdline_args = compile_template(self.cmdline_args_tmpl)
         if "description_tmpl" in update_params:
             self.description_tmpl = update_params["description_tmpl"]
-            self.jinja_description_tmpl = jinja2.Template(self.description_tmpl)
+            self.render_description = compile_template(self.description_tmpl)
         self.tmpl_cache.flush_all()
         queries = []
         for param in [
@@ -415,9 +508,8 @@ class ActiveMonitorDef(log.LoggingMixin):
 
     def iter_monitors(self) -> Iterator["ActiveMonitor"]:
         """List all monitors that use this monitor def."""
-        for monitor in self.manager.monitors.values():
-            if monitor.monitor_def.id == self.id:
-                yield monitor
+        for monitor_id in self.manager.monitors_by_def.get(self.id, ()):
+            yield self.manager.monitors[monitor_id]
 
     async def set_arg(self, new_arg: object_models.ActiveMonitorDefArg) -> None:
         existing_arg = self.get_arg_with_name(new_arg.name)
@@ -433,20 +525,21 @@ class ActiveMonitorDef(log.LoggingMixin):
                 self.manager.dbcon, new_arg
             )
             self.arg_spec.append(new_arg)
+        self._update_arg_cache()
         self.tmpl_cache.flush_all()
 
     async def delete_arg(self, name: str) -> None:
         arg = self.get_arg_with_name(name)
         if arg:
             self.arg_spec.remove(arg)
+            self._update_arg_cache()
             self.tmpl_cache.flush_all()
             await active_sql.delete_active_monitor_def_arg(self.manager.dbcon, arg.id)
 
     async def get_notify_data(self) -> Dict[str, str]:
         q = """select name, description from active_monitor_defs where id=%s"""
         q_args = (self.id,)
-        res = await self.manager.dbcon.fetch_all(q, q_args)
-        name, description = res[0]
+        name, description = await self.manager.dbcon.fetch_row(q, q_args)
         ret = {
             "name": name,
             "description": description,
@@ -454,6 +547,62 @@ class ActiveMonitorDef(log.LoggingMixin):
         return ret
 
 
+# Check result handlers, see ActiveMonitor.handle_check_result.
+# Each handler returns a tuple of:
+#   (next check interval, new monitor state or None, stats key)
+CheckResultAction = Tuple[int, Optional[str], str]
+
+
+def _check_up_monitor_up(monitor: "ActiveMonitor") -> CheckResultAction:
+    # Introduce a slight variation in monitoring intervals when
+    # everything is going ok for a monitor. This will help spread
+    # the service check times out. The jitter (-8 to +7s) is derived from
+    # the monitor id using a multiplicative hash, no need for random here.
+    return monitor.monitor_interval + monitor.interval_jitter, None, "checks_up"
+
+
+def _check_up_monitor_not_up(monitor: "ActiveMonitor") -> CheckResultAction:
+    return monitor.monitor_interval, "UP", "checks_up"
+
+
+def _check_down_monitor_down(monitor: "ActiveMonitor") -> CheckResultAction:
+    return monitor.monitor_interval, None, "checks_down"
+
+
+def _check_down_monitor_unknown(monitor: "ActiveMonitor") -> CheckResultAction:
+    return monitor.monitor_interval, "DOWN", "checks_down"
+
+
+def _check_down_monitor_up(monitor: "ActiveMonitor") -> CheckResultAction:
+    if monitor.consecutive_checks >= monitor.down_threshold:
+        return monitor.monitor_interval, "DOWN", "checks_down"
+    return 30, None, "checks_down"
+
+
+def _check_unknown_monitor_unknown(monitor: "ActiveMonitor") -> CheckResultAction:
+    return monitor.monitor_interval, None, "checks_unknown"
+
+
+def _check_unknown_monitor_not_unknown(monitor: "ActiveMonitor") -> CheckResultAction:
+    if monitor.consecutive_checks >= UNKNOWN_THRESHOLD:
+        return monitor.monitor_interval, "UNKNOWN", "checks_unknown"
+    return 120, None, "checks_unknown"
+
+
+# Maps (check result state, current monitor state) to a result handler.
+_CHECK_RESULT_HANDLERS = {
+    ("UP", "UP"): _check_up_monitor_up,
+    ("UP", "DOWN"): _check_up_monitor_not_up,
+    ("UP", "UNKNOWN"): _check_up_monitor_not_up,
+    ("DOWN", "DOWN"): _check_down_monitor_down,
+    ("DOWN", "UNKNOWN"): _check_down_monitor_unknown,
+    ("DOWN", "UP"): _check_down_monitor_up,
+    ("UNKNOWN", "UNKNOWN"): _check_unknown_monitor_unknown,
+    ("UNKNOWN", "UP"): _check_unknown_monitor_not_unknown,
+    ("UNKNOWN", "DOWN"): _check_unknown_monitor_not_unknown,
+}  # type: Dict[Tuple[str, str], Callable[[ActiveMonitor], CheckResultAction]]
+
+
 class ActiveMonitor(log.LoggingMixin):
     monitor_type = "active"
 
@@ -477,6 +626,7 @@ class ActiveMonitor(log.LoggingMixin):
         self.state = state
         self.manager = manager
         self.monitor_interval = manager.default_monitor_interval
+        self.interval_jitter = (((id * 2654435761) >> 24) & 0xF) - 8
         self.down_threshold = manager.default_down_threshold
         self.last_check_state = None  # type: Optional[str]
         self.consecutive_checks = 0
@@ -492,9 +642,14 @@ class ActiveMonitor(log.LoggingMixin):
         self.alerts_enabled = alerts_enabled
         self.alias = alias
         self._pending_reset = False
-        self.scheduled_job = None  # type: Optional[asyncio.Handle]
+        # Cached (expires, cache generations, contacts, metadata), see
+        # get_notify_contacts_and_metadata.
+        self._notify_cache = None  # type: Optional[Tuple[float, Tuple[int, int], Dict[str, set], Dict[str, str]]]
+        # The schedule bucket (loop time second) of the next check, if any.
+        self.scheduled_job = None  # type: Optional[int]
         self.scheduled_job_ts = 0.0
-        event.running("CREATE_ACTIVE_MONITOR", monitor=self)
+        if event.has_listeners("CREATE_ACTIVE_MONITOR"):
+            event.running("CREATE_ACTIVE_MONITOR", monitor=self)
         stats.inc("num_monitors", "ACT_MON")
 
     def __str__(self) -> str:
@@ -554,10 +709,12 @@ class ActiveMonitor(log.LoggingMixin):
             self.manager.schedule_monitor(self, self.monitor_interval)
             return
         expanded_args = self.get_expanded_args()
-        self.log_debug(
-            "monitoring: %s %s" % (self.monitor_def.cmdline_filename, expanded_args)
-        )
-        event.running("RUN_ACTIVE_MONITOR", monitor=self)
+        if log.debug_enabled():
+            self.log_debug(
+                "monitoring: %s %s" % (self.monitor_def.cmdline_filename, expanded_args)
+            )
+        if event.has_listeners("RUN_ACTIVE_MONITOR"):
+            event.running("RUN_ACTIVE_MONITOR", monitor=self)
         # noinspection PyUnusedLocal
         msg = ""  # type: Union[str, bytes]
         try:
@@ -568,70 +725,50 @@ class ActiveMonitor(log.LoggingMixin):
             check_state = "UP"
         except nagios.MonitorFailedError as e:
             msg = e.args[0]
-            self.log_debug("monitoring failed: %s" % msg)
+            if log.debug_enabled():
+                self.log_debug("monitoring failed: %s" % msg)
             check_state = "DOWN"
         except nagios.NagiosError as e:
-            self.log_debug("monitoring unknown error: %s" % (str(e)))
+            if log.debug_enabled():
+                self.log_debug("monitoring unknown error: %s" % (str(e)))
             check_state = "UNKNOWN"
             msg = str(e)
-        msg = msg[:199]  # Set a reasonable max length for stored monitor messages.
-        if type(msg) == bytes:
-            msg = cast(bytes, msg)
+        if isinstance(msg, (bytes, bytearray)):
             msg = msg.decode("utf-8", errors="ignore")
-        msg = cast(str, msg)
+        msg = msg[:199]  # Set a reasonable max length for stored monitor messages.
         self.msg = msg
-        self.update_consecutive_checks(check_state)
-        await self.handle_check_result(check_state, msg)
+        # Count consecutive checks with the same result.
+        if check_state == self.last_check_state:
+            self.consecutive_checks += 1
+        else:
+            self.consecutive_checks = 0
+        self.last_check_state = check_state
+        await self.handle_check_result(check_state, msg, time.time())
         self.log_debug("monitoring complete")
         if self.deleted:
             await self._purge()
 
-    async def handle_check_result(self, check_state: str, msg: str) -> None:
-        if check_state == "UP" and self.state == "UP":
-            # Introduce a slight variation in monitoring intervals when
-            # everything is going ok for a monitor. This will help spread
-            # the service check times out.
-            self.manager.schedule_monitor(
-                self, self.monitor_interval + random.randint(-5, 5)
+    async def handle_check_result(
+        self, check_state: str, msg: str, now: Optional[float] = None
+    ) -> None:
+        if now is None:
+            now = time.time()
+        handler = _CHECK_RESULT_HANDLERS[(check_state, self.state)]
+        interval, new_state, stats_key = handler(self)
+        if new_state:
+            await self.state_change(new_state, msg, now)
+        self.manager.schedule_monitor(self, interval)
+        self.manager.stats_counters[stats_key] += 1
+        if event.has_listeners("ACTIVE_MONITOR_CHECK_RESULT"):
+            event.running(
+                "ACTIVE_MONITOR_CHECK_RESULT",
+                monitor=self,
+                check_state=check_state,
+                msg=msg,
             )
-            stats.inc("checks_up", "ACT_MON")
-        elif check_state == "UP" and self.state != "UP":
-            self.manager.schedule_monitor(self, self.monitor_interval)
-            await self.state_change("UP", msg)
-            stats.inc("checks_up", "ACT_MON")
-        elif check_state == "DOWN" and self.state == "DOWN":
-            self.manager.schedule_monitor(self, self.monitor_interval)
-            stats.inc("checks_down", "ACT_MON")
-        elif check_state == "DOWN" and self.state == "UNKNOWN":
-            await self.state_change("DOWN", msg)
-            self.manager.schedule_monitor(self, self.monitor_interval)
-            stats.inc("checks_down", "ACT_MON")
-        elif check_state == "DOWN" and self.state != "DOWN":
-            if self.consecutive_checks >= self.down_threshold:
-                await self.state_change("DOWN", msg)
-                self.manager.schedule_monitor(self, self.monitor_interval)
-            else:
-                self.manager.schedule_monitor(self, 30)
-            stats.inc("checks_down", "ACT_MON")
-        elif check_state == "UNKNOWN" and self.state == "UNKNOWN":
-            self.manager.schedule_monitor(self, self.monitor_interval)
-            stats.inc("checks_unknown", "ACT_MON")
-        elif check_state == "UNKNOWN" and self.state != "UNKNOWN":
-            if self.consecutive_checks >= UNKNOWN_THRESHOLD:
-                await self.state_change("UNKNOWN", msg)
-                self.manager.schedule_monitor(self, self.monitor_interval)
-            else:
-                self.manager.schedule_monitor(self, 120)
-            stats.inc("checks_unknown", "ACT_MON")
-        event.running(
-            "ACTIVE_MONITOR_CHECK_RESULT",
-            monitor=self,
-            check_state=check_state,
-            msg=msg,
-        )
-        await self._save_monitor_result(check_state, msg)
+        await self._save_monitor_result(check_state, msg, now)
 
-    async def _save_monitor_result(self, check_state: str, msg: str):
+    async def _save_monitor_result(self, check_state: str, msg: str, now: float):
         """Store the result of a monitor run.
 
         Results are only stored if a max retention time is set. This is not
@@ -640,7 +777,7 @@ class ActiveMonitor(log.LoggingMixin):
         if not self.manager.result_retention_period:
             return
         result = object_models.ActiveMonitorResult(
-            id=None, monitor_id=self.id, timestamp=int(time.time()), state=check_state, result_msg=msg,
+            id=None, monitor_id=self.id, timestamp=int(now), state=check_state, result_msg=msg,
         )
         await active_sql.create_active_monitor_result(self.manager.dbcon, result)
 
@@ -649,12 +786,15 @@ class ActiveMonitor(log.LoggingMixin):
         self.state_ts = int(time.time())
         self.msg = ""
 
-    async def state_change(self, new_state: str, msg: str) -> None:
-        event.running("ACTIVE_MONITOR_STATE_CHANGE", monitor=self, new_state=new_state)
+    async def state_change(
+        self, new_state: str, msg: str, now: Optional[float] = None
+    ) -> None:
+        if event.has_listeners("ACTIVE_MONITOR_STATE_CHANGE"):
+            event.running("ACTIVE_MONITOR_STATE_CHANGE", monitor=self, new_state=new_state)
         prev_state = self.state
         prev_state_ts = self.state_ts
         self.state = new_state
-        self.state_ts = int(time.time())
+        self.state_ts = int(now if now is not None else time.time())
         self.msg = msg
         self.log_msg("changed state to %s - %s" % (new_state, msg))
         if new_state == "DOWN":
@@ -671,12 +811,9 @@ class ActiveMonitor(log.LoggingMixin):
         if not self.alerts_enabled:
             self.log_debug("skipping alert notifications, disabled")
             return
-        contacts = await contact.get_contact_dict_for_active_monitor(
-            self.manager.dbcon, self.id
-        )
-        metadata = await self.get_metadata()
+        contacts, meta = await self.get_notify_contacts_and_metadata()
         tmpl_data = {}  # type: Dict[str, Any]
-        for key, value in metadata.items():
+        for key, value in meta.items():
             tmpl_data["meta_%s" % key] = value
         if prev_state_ts and self.state_ts - prev_state_ts:
             tmpl_data["state_elapsed"] = utils.get_display_time(
@@ -694,40 +831,51 @@ class ActiveMonitor(log.LoggingMixin):
             self.manager.notification_manager.send_notification(contacts, tmpl_data)
         )
 
-    def update_consecutive_checks(self, state: str) -> None:
-        """Update the counter for consecutive checks with the same result."""
-        if state == self.last_check_state:
-            self.consecutive_checks += 1
-        else:
-            self.consecutive_checks = 0
-        self.last_check_state = state
-
     async def set_up(self) -> None:
         """Set a monitor up (in the database)."""
-
-        async def _run(cur: sql.Cursor) -> None:
-            if self.alert_id:
-                await self.txn_close_alert(cur)
-            await self.txn_save_state(cur)
-
-        await self.manager.dbcon.transact(_run)
+        await self._save_state_close_alert()
 
     async def set_down(self) -> None:
-        """Set a monitor down (in the database)."""
+        """Set a monitor down (in the database).
 
-        async def _run(cur: sql.Cursor) -> None:
-            await self.txn_create_alert(cur)
-            await self.txn_save_state(cur)
+        This uses a transaction rather than a query list since the state
+        update needs the id of the newly created alert.
+        """
+        await self.manager.dbcon.transact(self._txn_set_down)
 
-        await self.manager.dbcon.transact(_run)
+    async def _txn_set_down(self, cur: sql.Cursor) -> None:
+        await self.txn_create_alert(cur)
+        await self.txn_save_state(cur)
 
     async def set_unknown(self) -> None:
         """Set a monitor in unknown state (in the database)."""
+        await self.manager.dbcon.multi_operation(
+            [self.save_state_query(self.alert_id)]
+        )
 
-        async def _run(cur: sql.Cursor) -> None:
-            await self.txn_save_state(cur)
+    async def _save_state_close_alert(self) -> None:
+        """Save the monitors state and close its current alert, if any.
 
-        await self.manager.dbcon.transact(_run)
+        alert_id is only reset once the queries have been committed.
+        """
+        queries = []
+        if self.alert_id:
+            queries.append(self.close_alert_query())
+        queries.append(self.save_state_query(None))
+        await self.manager.dbcon.multi_operation(queries)
+        self.alert_id = None
+
+    def close_alert_query(self) -> Tuple[str, Tuple]:
+        """Get a query that closes the monitors current alert."""
+        q = """update active_monitor_alerts set end_ts=%s where id=%s"""
+        q_args = (self.state_ts, self.alert_id)
+        return q, q_args
+
+    def save_state_query(self, alert_id: Optional[int]) -> Tuple[str, Tuple]:
+        """Get a query that saves the monitors current state."""
+        q = """update active_monitors set state=%s, state_ts=%s, msg=%s, alert_id=%s where id=%s"""
+        q_args = (self.state, self.state_ts, self.msg, alert_id, self.id)
+        return q, q_args
 
     async def txn_create_alert(self, cur: sql.Cursor) -> None:
         q = """insert into active_monitor_alerts (monitor_id, start_ts, end_ts, alert_msg) values (%s, %s, %s, %s)"""
@@ -735,15 +883,8 @@ class ActiveMonitor(log.LoggingMixin):
         await cur.execute(self.manager.dbcon.prep_query(q), q_args)
         self.alert_id = cur.lastrowid
 
-    async def txn_close_alert(self, cur: sql.Cursor) -> None:
-        q = """update active_monitor_alerts set end_ts=%s where id=%s"""
-        q_args = (self.state_ts, self.alert_id)
-        await cur.execute(self.manager.dbcon.prep_query(q), q_args)
-        self.alert_id = None
-
     async def txn_save_state(self, cur: sql.Cursor) -> None:
-        q = """update active_monitors set state=%s, state_ts=%s, msg=%s, alert_id=%s where id=%s"""
-        q_args = (self.state, self.state_ts, self.msg, self.alert_id, self.id)
+        q, q_args = self.save_state_query(self.alert_id)
         await cur.execute(self.manager.dbcon.prep_query(q), q_args)
 
     async def delete(self) -> None:
@@ -755,10 +896,12 @@ class ActiveMonitor(log.LoggingMixin):
         if self.deleted:
             return
         self.log_msg("deleting monitor")
-        event.running("DELETE_ACTIVE_MONITOR", monitor=self)
+        if event.has_listeners("DELETE_ACTIVE_MONITOR"):
+            event.running("DELETE_ACTIVE_MONITOR", monitor=self)
         self.deleted = True
         if self.id in self.manager.monitors:
             del self.manager.monitors[self.id]
+        self.manager.monitors_by_def[self.monitor_def.id].discard(self.id)
         if self.monitoring:
             q = """update active_monitors set deleted=%s where id=%s"""
             q_args = (True, self.id)
@@ -778,15 +921,7 @@ class ActiveMonitor(log.LoggingMixin):
         self.monitor_def.validate_monitor_args(args)
         self.args = args
         self.monitor_def.tmpl_cache.flush_monitor(self)
-        queries = []
-        q = """delete from active_monitor_args where monitor_id=%s"""
-        q_args = (self.id,)  # type: Tuple
-        queries.append((q, q_args))
-        q = """insert into active_monitor_args (monitor_id, name, value) values (%s, %s, %s)"""
-        for name, value in args.items():
-            q_args = (self.id, name, value)
-            queries.append((q, q_args))
-        await self.manager.dbcon.multi_operation(queries)
+        await active_sql.update_active_monitor_args(self.manager.dbcon, self.id, args)
 
     async def set_checks_enabled_status(self, checks_enabled: bool) -> None:
         if self.checks_enabled == checks_enabled:
@@ -823,9 +958,29 @@ class ActiveMonitor(log.LoggingMixin):
             self.manager.schedule_monitor(self, 5)
 
     async def get_metadata(self) -> Dict[str, str]:
-        ret = await get_metadata(self.manager.dbcon, "active_monitor", self.id)
+        ret = await metadata.get_metadata(self.manager.dbcon, "active_monitor", self.id)
         return ret
 
+    async def get_notify_contacts_and_metadata(
+        self,
+    ) -> Tuple[Dict[str, set], Dict[str, str]]:
+        """Get the contacts and metadata used for notifications.
+
+        The result is cached for NOTIFY_CACHE_TTL seconds, or until any
+        contact or metadata is changed.
+        """
+        now = time.time()
+        generations = (contact.cache_generation, metadata.cache_generation)
+        cache = self._notify_cache
+        if cache and cache[0] > now and cache[1] == generations:
+            return cache[2], cache[3]
+        contacts = await contact.get_contact_dict_for_active_monitor(
+            self.manager.dbcon, self.id
+        )
+        meta = await self.get_metadata()
+        self._notify_cache = (now + NOTIFY_CACHE_TTL, generations, contacts, meta)
+        return contacts, meta
+
     async def reset_monitor(self) -> None:
         """Reset a monitor to its initial state.
 
@@ -840,13 +995,7 @@ class ActiveMonitor(log.LoggingMixin):
         self.state_ts = int(time.time())
         self.msg = ""
         self.consecutive_checks = 0
-
-        async def _run(cur: sql.Cursor) -> None:
-            if self.alert_id:
-                await self.txn_close_alert(cur)
-            await self.txn_save_state(cur)
-
-        await self.manager.dbcon.transact(_run)
+        await self._save_state_close_alert()
 
 
 async def remove_deleted_monitors(dbcon: DBConnection) -> None:
@@ -855,10 +1004,8 @@ async def remove_deleted_monitors(dbcon: DBConnection) -> None:
     This runs once every time the server starts up.
     """
     log.msg("Purging all deleted active monitors")
-    q = """select id from active_monitors where deleted=%s"""
-    rows = await dbcon.fetch_all(q, (True,))
-    for monitor_id in rows:
-        await active_sql.delete_active_monitor(dbcon, monitor_id)
+    monitor_ids = await active_sql.get_deleted_active_monitor_ids(dbcon)
+    await active_sql.delete_active_monitors(dbcon, monitor_ids)
 
 
 async def create_active_monitor(
@@ -887,9 +1034,20 @@ async def create_active_monitor(
 
 
 async def create_active_monitor_def(
-    manager: ActiveMonitorManager, model: object_models.ActiveMonitorDef
+    manager: ActiveMonitorManager,
+    model: object_models.ActiveMonitorDef,
+    args: Optional[List[object_models.ActiveMonitorDefArg]] = None,
 ) -> ActiveMonitorDef:
+    """Create a new monitor def, optionally with an initial set of args."""
     monitor_def_id = await active_sql.create_active_monitor_def(manager.dbcon, model)
+    arg_spec = []  # type: List[object_models.ActiveMonitorDefArg]
+    if args:
+        for arg in args:
+            arg.active_monitor_def_id = monitor_def_id
+        arg_ids = await active_sql.create_active_monitor_def_args(manager.dbcon, args)
+        for arg, arg_id in zip(args, arg_ids):
+            arg.id = arg_id
+        arg_spec = list(args)
     monitor_def = ActiveMonitorDef(
         monitor_def_id,
         model.name,
@@ -897,11 +1055,12 @@ async def create_active_monitor_def(
         model.cmdline_filename,
         model.cmdline_args_tmpl,
         model.description_tmpl,
-        [],
+        arg_spec,
         manager,
     )
     log.msg("Created active monitor def %s" % monitor_def)
     manager.monitor_defs[monitor_def.id] = monitor_def
+    manager.update_monitor_def_names()
     return monitor_def
 
 
@@ -909,9 +1068,4 @@ def get_monitor_def_by_name(
     manager: ActiveMonitorManager, name: str
 ) -> Optional[ActiveMonitorDef]:
     """Get a monitor definition based on its name."""
-    ret = None
-    for monitor_def in manager.monitor_defs.values():
-        if monitor_def.name == name:
-            ret = monitor_def
-            break
-    return ret
+    return manager.monitor_defs_by_name.get(name)
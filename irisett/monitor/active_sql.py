@@ -1,36 +1,106 @@
 """SQL functions for active monitors."""
 
-from typing import Iterable, Optional, Dict, Tuple
+from typing import Iterable, Optional, Dict, Tuple, List
+from itertools import groupby, starmap
+from operator import itemgetter
+import asyncio
 
 from irisett.sql import DBConnection
+from irisett.object_exists import invalidate_exists
 from irisett import (
     object_models,
     sql,
 )
 
+_SELECT_DEFS_SQL = """select id, name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl
+    from active_monitor_defs"""
+_SELECT_DEF_SQL = """select id, name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl
+    from active_monitor_defs where id=%s"""
+_SELECT_DEF_ARGS_SQL = """select id, active_monitor_def_id, name, display_name, description, required, default_value
+    from active_monitor_def_args"""
+_SELECT_DEF_ARGS_FOR_DEF_SQL = """select id, active_monitor_def_id, name, display_name, description, required, default_value
+    from active_monitor_def_args where active_monitor_def_id=%s"""
+_SELECT_MONITORS_SQL = """select id, def_id, state, state_ts, msg, alert_id, deleted, checks_enabled, alerts_enabled, alias
+    from active_monitors"""
+_SELECT_MONITOR_IDS_SQL = """select id from active_monitors"""
+_SELECT_ARGS_SQL = """select id, monitor_id, name, value from active_monitor_args"""
+_SELECT_DEFS_WITH_ARGS_SQL = """select mdef.id, mdef.name, mdef.description, mdef.active, mdef.cmdline_filename,
+    mdef.cmdline_args_tmpl, mdef.description_tmpl,
+    arg.id, arg.active_monitor_def_id, arg.name, arg.display_name, arg.description, arg.required, arg.default_value
+    from active_monitor_defs as mdef
+    left join active_monitor_def_args as arg on arg.active_monitor_def_id=mdef.id
+    order by mdef.id"""
+_SELECT_MONITORS_WITH_ARGS_SQL = """select mon.id, mon.def_id, mon.state, mon.state_ts, mon.msg, mon.alert_id, mon.deleted,
+    mon.checks_enabled, mon.alerts_enabled, mon.alias, arg.name, arg.value
+    from active_monitors as mon
+    left join active_monitor_args as arg on arg.monitor_id=mon.id
+    order by mon.id"""
+_SELECT_MONITORS_FOR_METADATA_SQL = """select mon.id, mon.def_id, mon.state, mon.state_ts, mon.msg, mon.alert_id, mon.deleted,
+    mon.checks_enabled, mon.alerts_enabled, mon.alias
+    from object_metadata as meta
+    inner join active_monitors as mon on mon.id=meta.object_id
+    where meta.object_type="active_monitor" and meta.key=%s and meta.value=%s"""
+_SELECT_MONITOR_IDS_FOR_METADATA_SQL = """select object_id from object_metadata
+    where object_type="active_monitor" and key=%s and value=%s"""
+_INSERT_MONITOR_SQL = """insert into active_monitors (def_id, state, state_ts, msg) values (%s, %s, %s, %s)"""
+_INSERT_ARGS_SQL = """insert into active_monitor_args (monitor_id, name, value) values """
+_INSERT_ARGS_ROW_SQL = """(%s, %s, %s)"""
+_DELETE_ARGS_SQL = """delete from active_monitor_args where monitor_id=%s"""
+# Statements removing all traces of monitors, formatted with a list of id
+# placeholders.
+_DELETE_MONITORS_SQL = [
+    """delete from active_monitors where id in (%s)""",
+    """delete from active_monitor_args where monitor_id in (%s)""",
+    """delete from active_monitor_alerts where monitor_id in (%s)""",
+    """delete from active_monitor_contacts where active_monitor_id in (%s)""",
+    """delete from active_monitor_contact_groups where active_monitor_id in (%s)""",
+    """delete from object_metadata where object_type="active_monitor" and object_id in (%s)""",
+    """delete from object_bindata where object_type="active_monitor" and object_id in (%s)""",
+    """delete from monitor_group_active_monitors where active_monitor_id in (%s)""",
+]
+# Max number of ids per statement in delete_active_monitors.
+_DELETE_MONITORS_CHUNK_SIZE = 1000
+_SELECT_DELETED_MONITOR_IDS_SQL = """select id from active_monitors where deleted=%s"""
+_INSERT_DEF_SQL = """insert into active_monitor_defs
+    (name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl)
+    values (%s, %s, %s, %s, %s, %s)"""
+_DELETE_DEF_SQL = [
+    """delete from active_monitor_defs where id=%s""",
+    """delete from active_monitor_def_args where active_monitor_def_id=%s""",
+]
+_INSERT_DEF_ARG_SQL = """insert into active_monitor_def_args
+    (active_monitor_def_id, name, display_name, description, required, default_value)
+    values (%s, %s, %s, %s, %s, %s)"""
+_UPDATE_DEF_ARG_SQL = """update active_monitor_def_args
+    set name=%s, display_name=%s, description=%s, required=%s, default_value=%s
+    where id=%s"""
+_DELETE_DEF_ARG_SQL = """delete from active_monitor_def_args where id=%s"""
+_INSERT_RESULT_SQL = """insert into active_monitor_results
+    (monitor_id, timestamp, state, result_msg)
+    values (%s, %s, %s, %s)"""
+_SELECT_PURGE_RESULT_IDS_SQL = """select id from active_monitor_results where timestamp < %s limit %s"""
+_PURGE_RESULTS_SQL = """delete from active_monitor_results where id in (%s)"""
+# Max number of results removed per statement by purge_active_monitor_results.
+_PURGE_RESULTS_CHUNK_SIZE = 5000
+_SELECT_RESULTS_FOR_MONITOR_SQL = """select id, monitor_id, timestamp, state, result_msg
+    from active_monitor_results where monitor_id=%s order by timestamp desc"""
+
 
 async def get_all_active_monitor_defs(
     dbcon: DBConnection,
 ) -> Iterable[object_models.ActiveMonitorDef]:
     """Load monitor defs from the database."""
-    q = """select id, name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl
-        from active_monitor_defs"""
-    return [object_models.ActiveMonitorDef(*row) for row in await dbcon.fetch_all(q)]
+    return list(starmap(object_models.ActiveMonitorDef, await dbcon.fetch_all(_SELECT_DEFS_SQL)))
 
 
 async def get_active_monitor_def(
     dbcon: DBConnection, id: int
 ) -> Optional[object_models.ActiveMonitorDef]:
     """Load one monitor def from the database."""
-    q = """select id, name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl
-        from active_monitor_defs where id=%s"""
-    res = [
-        object_models.ActiveMonitorDef(*row) for row in await dbcon.fetch_all(q, (id,))
-    ]
-    if res:
-        active_monitor_def = res[0]  # type: Optional[object_models.ActiveMonitorDef]
-    else:
-        active_monitor_def = None
+    row = await dbcon.fetch_row(_SELECT_DEF_SQL, (id,))
+    active_monitor_def = None  # type: Optional[object_models.ActiveMonitorDef]
+    if row:
+        active_monitor_def = object_models.ActiveMonitorDef(*row)
     return active_monitor_def
 
 
@@ -38,64 +108,121 @@ async def get_all_active_monitor_def_args(
     dbcon: DBConnection,
 ) -> Iterable[object_models.ActiveMonitorDefArg]:
     """Load monitor def args from the database."""
-    q = """select id, active_monitor_def_id, name, display_name, description, required, default_value
-            from active_monitor_def_args"""
-    return [object_models.ActiveMonitorDefArg(*row) for row in await dbcon.fetch_all(q)]
+    return list(starmap(object_models.ActiveMonitorDefArg, await dbcon.fetch_all(_SELECT_DEF_ARGS_SQL)))
 
 
 async def get_active_monitor_def_args_for_def(
     dbcon: DBConnection, def_id: int
 ) -> Iterable[object_models.ActiveMonitorDefArg]:
     """Load the monitor def args for a monitor def."""
-    q = """select id, active_monitor_def_id, name, display_name, description, required, default_value
-            from active_monitor_def_args where active_monitor_def_id=%s"""
-    return [
-        object_models.ActiveMonitorDefArg(*row)
-        for row in await dbcon.fetch_all(q, (def_id,))
-    ]
+    rows = await dbcon.fetch_all(_SELECT_DEF_ARGS_FOR_DEF_SQL, (def_id,))
+    return list(starmap(object_models.ActiveMonitorDefArg, rows))
 
 
 async def get_all_active_monitors(
     dbcon: DBConnection,
 ) -> Iterable[object_models.ActiveMonitor]:
     """Load monitors from the database."""
-    q = """select id, def_id, state, state_ts, msg, alert_id, deleted, checks_enabled, alerts_enabled, alias
-            from active_monitors"""
-    return [object_models.ActiveMonitor(*row) for row in await dbcon.fetch_all(q)]
+    return list(starmap(object_models.ActiveMonitor, await dbcon.fetch_all(_SELECT_MONITORS_SQL)))
+
+
+async def get_all_active_monitor_ids(dbcon: DBConnection) -> List[int]:
+    """Get the ids of all monitors without loading the monitors."""
+    return [row[0] for row in await dbcon.fetch_all(_SELECT_MONITOR_IDS_SQL)]
 
 
 async def get_all_active_monitor_args(
     dbcon: DBConnection,
 ) -> Iterable[object_models.ActiveMonitorArg]:
     """Load monitor args from the database."""
-    q = """select id, monitor_id, name, value from active_monitor_args"""
-    return [object_models.ActiveMonitorArg(*row) for row in await dbcon.fetch_all(q)]
+    return list(starmap(object_models.ActiveMonitorArg, await dbcon.fetch_all(_SELECT_ARGS_SQL)))
+
+
+def _group_def_rows(
+    rows: List,
+) -> List[Tuple[object_models.ActiveMonitorDef, List[object_models.ActiveMonitorDefArg]]]:
+    ret = []
+    for _, def_rows in groupby(rows, key=itemgetter(0)):
+        def_rows = list(def_rows)
+        monitor_def = object_models.ActiveMonitorDef(*def_rows[0][:7])
+        args = [
+            object_models.ActiveMonitorDefArg(*row[7:])
+            for row in def_rows if row[7] is not None
+        ]
+        ret.append((monitor_def, args))
+    return ret
+
+
+def _group_monitor_rows(rows: List) -> List[object_models.ActiveMonitor]:
+    ret = []
+    for _, monitor_rows in groupby(rows, key=itemgetter(0)):
+        monitor_rows = list(monitor_rows)
+        monitor = object_models.ActiveMonitor(*monitor_rows[0][:10])
+        monitor.args = {row[10]: row[11] for row in monitor_rows if row[10] is not None}
+        ret.append(monitor)
+    return ret
+
+
+async def get_all_active_monitor_data(
+    dbcon: DBConnection,
+) -> Tuple[
+    List[Tuple[object_models.ActiveMonitorDef, List[object_models.ActiveMonitorDefArg]]],
+    List[object_models.ActiveMonitor],
+]:
+    """Load all monitor defs and monitors, with args, from the database.
+
+    These are the largest result sets read, so fetch_all_fast is used and
+    both queries run concurrently.
+    """
+    def_rows, monitor_rows = await asyncio.gather(
+        dbcon.fetch_all_fast(_SELECT_DEFS_WITH_ARGS_SQL),
+        dbcon.fetch_all_fast(_SELECT_MONITORS_WITH_ARGS_SQL),
+    )
+    return _group_def_rows(def_rows), _group_monitor_rows(monitor_rows)
 
 
 async def get_active_monitors_for_metadata(
     dbcon: DBConnection, meta_key: str, meta_value: str
 ):
-    q = """select mon.id, mon.def_id, mon.state, mon.state_ts, mon.msg, mon.alert_id, mon.deleted,
-        mon.checks_enabled, mon.alerts_enabled
-        from active_monitors as mon, object_metadata as meta
-        where meta.key=%s and meta.value=%s and meta.object_type="active_monitor" and meta.object_id=mon.id"""
     q_args = (meta_key, meta_value)
-    return [
-        object_models.ActiveMonitor(*row) for row in await dbcon.fetch_all(q, q_args)
-    ]
+    rows = await dbcon.fetch_all(_SELECT_MONITORS_FOR_METADATA_SQL, q_args)
+    return list(starmap(object_models.ActiveMonitor, rows))
+
+
+async def get_active_monitor_ids_for_metadata(
+    dbcon: DBConnection, meta_key: str, meta_value: str
+) -> List[int]:
+    """Get the ids of monitors with a metadata key/value.
+
+    The active_monitors table isn't joined, the ids may include monitors
+    that have been removed.
+    """
+    q_args = (meta_key, meta_value)
+    rows = await dbcon.fetch_all(_SELECT_MONITOR_IDS_FOR_METADATA_SQL, q_args)
+    return [row[0] for row in rows]
+
+
+def _insert_args_query(monitor_id: int, monitor_args: Dict[str, str]) -> Tuple[str, Tuple]:
+    """Build a single multi-row insert for a monitors arguments.
+
+    All args are sent as one statement instead of one insert per arg.
+    """
+    q = _INSERT_ARGS_SQL + ", ".join([_INSERT_ARGS_ROW_SQL] * len(monitor_args))
+    q_args = []  # type: List
+    for name, value in monitor_args.items():
+        q_args += [monitor_id, name, value]
+    return q, tuple(q_args)
 
 
 async def create_active_monitor(
     dbcon: DBConnection, monitor_def_id: int, monitor_args: Dict[str, str]
 ) -> int:
     async def _run(cur: sql.Cursor) -> int:
-        q = """insert into active_monitors (def_id, state, state_ts, msg) values (%s, %s, %s, %s)"""
         q_args = (monitor_def_id, "UNKNOWN", 0, "")  # type: Tuple
-        await cur.execute(dbcon.prep_query(q), q_args)
+        await cur.execute(dbcon.prep_query(_INSERT_MONITOR_SQL), q_args)
         _monitor_id = cur.lastrowid
-        q = """insert into active_monitor_args (monitor_id, name, value) values (%s, %s, %s)"""
-        for name, value in monitor_args.items():
-            q_args = (_monitor_id, name, value)
+        if monitor_args:
+            q, q_args = _insert_args_query(_monitor_id, monitor_args)
             await cur.execute(dbcon.prep_query(q), q_args)
         return _monitor_id
 
@@ -103,66 +230,83 @@ async def create_active_monitor(
     return monitor_id
 
 
+async def update_active_monitor_args(
+    dbcon: DBConnection, monitor_id: int, monitor_args: Dict[str, str]
+) -> None:
+    """Replace all arguments for a monitor.
+
+    The old args are deleted and the new args inserted with a single
+    multi-row insert.
+    """
+    queries = [(_DELETE_ARGS_SQL, (monitor_id,))]  # type: List[Tuple[str, Tuple]]
+    if monitor_args:
+        queries.append(_insert_args_query(monitor_id, monitor_args))
+    await dbcon.multi_operation(queries)
+
+
 async def delete_active_monitor(dbcon: DBConnection, monitor_id: int) -> None:
     """Remove all traces of a monitor from the database."""
-    q_args = (monitor_id,)
-    queries = [
-        ("""delete from active_monitors where id=%s""", q_args),
-        ("""delete from active_monitor_alerts where monitor_id=%s""", q_args),
-        ("""delete from active_monitor_contacts where active_monitor_id=%s""", q_args),
-        (
-            """delete from object_metadata where object_type="active_monitor" and object_id=%s""",
-            q_args,
-        ),
-        (
-            """delete from object_bindata where object_type="active_monitor" and object_id=%s""",
-            q_args,
-        ),
-        ("""delete from monitor_group_active_monitors where active_monitor_id=%s""", q_args),
-    ]
-    await dbcon.multi_operation(queries)
+    await delete_active_monitors(dbcon, [monitor_id])
+
+
+async def delete_active_monitors(dbcon: DBConnection, monitor_ids: List[int]) -> None:
+    """Remove all traces of many monitors from the database.
+
+    Each table is cleared with one statement per chunk of
+    _DELETE_MONITORS_CHUNK_SIZE ids.
+    """
+    queries = []  # type: List[Tuple[str, Tuple]]
+    for pos in range(0, len(monitor_ids), _DELETE_MONITORS_CHUNK_SIZE):
+        chunk = tuple(monitor_ids[pos : pos + _DELETE_MONITORS_CHUNK_SIZE])
+        placeholders = ", ".join(["%s"] * len(chunk))
+        queries += [(q % placeholders, chunk) for q in _DELETE_MONITORS_SQL]
+    if queries:
+        await dbcon.multi_operation(queries)
+    invalidate_exists(dbcon, "active_monitors", monitor_ids)
+
+
+async def get_deleted_active_monitor_ids(dbcon: DBConnection) -> List[int]:
+    """Get the ids of all monitors that have been set as deleted."""
+    rows = await dbcon.fetch_all(_SELECT_DELETED_MONITOR_IDS_SQL, (True,))
+    return [row[0] for row in rows]
 
 
 async def create_active_monitor_def(
     dbcon: DBConnection, model: object_models.ActiveMonitorDef
 ) -> int:
-    q = """insert into active_monitor_defs
-        (name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl)
-        values (%s, %s, %s, %s, %s, %s)"""
-    monitor_def_id = await dbcon.operation(q, object_models.insert_values(model))
+    monitor_def_id = await dbcon.operation(_INSERT_DEF_SQL, object_models.insert_values(model))
     return monitor_def_id
 
 
 async def delete_active_monitor_def(dbcon: DBConnection, monitor_def_id: int) -> None:
     """Remove all traces of a monitor def from the database."""
-
     q_args = (monitor_def_id,)
-    queries = [
-        ("""delete from active_monitor_defs where id=%s""", q_args),
-        (
-            """delete from active_monitor_def_args where active_monitor_def_id=%s""",
-            q_args,
-        ),
-    ]
+    queries = [(q, q_args) for q in _DELETE_DEF_SQL]
     await dbcon.multi_operation(queries)
 
 
 async def create_active_monitor_def_arg(
     dbcon: DBConnection, arg: object_models.ActiveMonitorDefArg
 ) -> int:
-    q = """insert into active_monitor_def_args
-    (active_monitor_def_id, name, display_name, description, required, default_value)
-    values (%s, %s, %s, %s, %s, %s)"""
-    arg_id = await dbcon.operation(q, object_models.insert_values(arg))
+    arg_id = await dbcon.operation(_INSERT_DEF_ARG_SQL, object_models.insert_values(arg))
     return arg_id
 
 
+async def create_active_monitor_def_args(
+    dbcon: DBConnection, args: Iterable[object_models.ActiveMonitorDefArg]
+) -> List[int]:
+    """Create multiple monitor def args concurrently.
+
+    The args are independent of each other once the monitor def exists so
+    the inserts are run in parallel, each on its own pooled connection.
+    Returns the new arg ids in the same order as the passed in args.
+    """
+    return list(await asyncio.gather(*[create_active_monitor_def_arg(dbcon, arg) for arg in args]))
+
+
 async def update_active_monitor_def_arg(
     dbcon: DBConnection, arg: object_models.ActiveMonitorDefArg
 ) -> None:
-    q = """update active_monitor_def_args
-        set name=%s, display_name=%s, description=%s, required=%s, default_value=%s
-        where id=%s"""
     q_args = (
         arg.name,
         arg.display_name,
@@ -171,35 +315,50 @@ async def update_active_monitor_def_arg(
         arg.default_value,
         arg.id,
     )
-    await dbcon.operation(q, q_args)
+    await dbcon.operation(_UPDATE_DEF_ARG_SQL, q_args)
 
 
 async def delete_active_monitor_def_arg(dbcon: DBConnection, arg_id: int) -> None:
-    q = """delete from active_monitor_def_args where id=%s"""
-    await dbcon.operation(q, (arg_id,))
+    await dbcon.operation(_DELETE_DEF_ARG_SQL, (arg_id,))
 
 
 async def create_active_monitor_result(
     dbcon: DBConnection, model: object_models.ActiveMonitorResult
 ) -> int:
-    q = """insert into active_monitor_results
-        (monitor_id, timestamp, state, result_msg)
-        values (%s, %s, %s, %s)"""
-    result_id = await dbcon.operation(q, object_models.insert_values(model))
+    result_id = await dbcon.operation(_INSERT_RESULT_SQL, object_models.insert_values(model))
     return result_id
 
 
 async def purge_active_monitor_results(
     dbcon: DBConnection, timestamp: int
 ) -> int:
-    q = """delete from active_monitor_results where timestamp < %s"""
-    await dbcon.operation(q, timestamp)
+    """Remove monitor results older than timestamp.
+
+    Results are removed in chunks of _PURGE_RESULTS_CHUNK_SIZE rows to
+    avoid long running deletes locking the table. Returns the number of
+    removed results.
+    """
+    purged = 0
+    while True:
+        rows = await dbcon.fetch_all(
+            _SELECT_PURGE_RESULT_IDS_SQL, (timestamp, _PURGE_RESULTS_CHUNK_SIZE)
+        )
+        if not rows:
+            break
+        result_ids = tuple(row[0] for row in rows)
+        q = _PURGE_RESULTS_SQL % ", ".join(["%s"] * len(result_ids))
+        await dbcon.operation(q, result_ids)
+        purged += len(result_ids)
+        if len(result_ids) < _PURGE_RESULTS_CHUNK_SIZE:
+            break
+        # Let the monitors run between chunks.
+        await asyncio.sleep(0)
+    return purged
 
 
 async def get_active_monitor_results_for_monitor(
     dbcon: DBConnection, monitor_id: int
 ) -> Iterable[object_models.ActiveMonitorResult]:
     """Load monitor results from the database."""
-    q = """select id, monitor_id, timestamp, state, result_msg
-        from active_monitor_results where monitor_id=%s order by timestamp desc"""
-    return [object_models.ActiveMonitorResult(*row) for row in await dbcon.fetch_all(q, (monitor_id,))]
+    rows = await dbcon.fetch_all(_SELECT_RESULTS_FOR_MONITOR_SQL, (monitor_id,))
+    return list(starmap(object_models.ActiveMonitorResult, rows))
@@ -5,19 +5,52 @@ as a cosmetic feature, but also to connect multiple monitors to contacts
 without setting the contact(s) for each monitor.
 """
 
-from typing import Optional, Dict, Any, Iterable
-from irisett.sql import DBConnection
+from typing import Optional, Dict, Any, Iterable, Tuple, List
+from itertools import starmap
+import asyncio
+from irisett.sql import DBConnection, Cursor
 from irisett import (
     errors,
     object_models,
+    contact,
 )
 from irisett.object_exists import (
     monitor_group_exists,
-    contact_exists,
-    active_monitor_exists,
-    contact_group_exists,
+    active_monitors_exist,
+    contacts_exist,
+    contact_groups_exist,
+    invalidate_exists,
+    bulk_exists,
 )
 
+_LINK_CHUNK_SIZE = 500
+_SELECT_GROUPS_SQL = """select id, parent_id, name from monitor_groups"""
+_SELECT_GROUP_SQL = """select id, parent_id, name from monitor_groups where id=%s"""
+_SELECT_GROUP_CONTACTS_SQL = """select contacts.id, contacts.name, contacts.email, contacts.phone, contacts.active
+    from monitor_group_contacts as mgc
+    inner join contacts on contacts.id=mgc.contact_id
+    where mgc.monitor_group_id=%s"""
+_SELECT_GROUP_CONTACT_GROUPS_SQL = """select cg.id, cg.name, cg.active
+    from monitor_group_contact_groups as mgcg
+    inner join contact_groups as cg on cg.id=mgcg.contact_group_id
+    where mgcg.monitor_group_id=%s"""
+_SELECT_GROUP_ACTIVE_MONITORS_SQL = """select mon.id, mon.def_id, mon.state, mon.state_ts, mon.msg, mon.alert_id, mon.deleted,
+    mon.checks_enabled, mon.alerts_enabled, mon.alias
+    from monitor_group_active_monitors as mgam
+    inner join active_monitors as mon on mon.id=mgam.active_monitor_id
+    where mgam.monitor_group_id=%s"""
+_SELECT_GROUP_ACTIVE_MONITOR_IDS_SQL = """select active_monitor_id from monitor_group_active_monitors
+    where monitor_group_id=%s"""
+_SELECT_GROUPS_FOR_METADATA_SQL = """select mg.id, mg.parent_id, mg.name
+    from object_metadata as meta
+    inner join monitor_groups as mg on mg.id=meta.object_id
+    where meta.object_type="monitor_group" and meta.key=%s and meta.value=%s"""
+_SELECT_GROUP_MONITOR_METADATA_SQL = """select metadata.object_type, metadata.object_id, metadata.key, metadata.value
+    from monitor_group_active_monitors as mgam
+    inner join object_metadata as metadata
+    on metadata.object_type="active_monitor" and metadata.object_id=mgam.active_monitor_id
+    where mgam.monitor_group_id=%s"""
+
 
 async def create_monitor_group(
     dbcon: DBConnection, parent_id: Optional[int], name: str
@@ -26,14 +59,24 @@ async def create_monitor_group(
     if not name:
         raise errors.InvalidArguments("missing monitor group name")
     if parent_id:
-        if not await monitor_group_exists(dbcon, parent_id):
+        # The parent lookup is part of the insert, nothing is inserted if
+        # the parent doesn't exist.
+        q = """insert into monitor_groups (parent_id, name)
+            select id, %s from monitor_groups where id=%s"""
+        q_args = (name, parent_id)
+
+        async def _run(cur: Cursor) -> Optional[int]:
+            await cur.execute(dbcon.prep_query(q), q_args)
+            if not cur.rowcount:
+                return None
+            return cur.lastrowid
+
+        group_id = await dbcon.transact(_run)
+        if group_id is None:
             raise errors.InvalidArguments("parent monitor group does not exist")
-        q = """insert into monitor_groups (parent_id, name) values (%s, %s)"""
-        q_args = (parent_id, name)  # type: Any
     else:
         q = """insert into monitor_groups (name) values (%s)"""
-        q_args = (name,)
-    group_id = await dbcon.operation(q, q_args)
+        group_id = await dbcon.operation(q, (name,))
     return group_id
 
 
@@ -43,130 +86,345 @@ async def update_monitor_group(
     """Update a monitor group in the database.
 
     Data is a dict with parent_id/name values that will be updated.
+    All values are updated using a single statement.
     """
-    queries = []
-    for key, value in data.items():
+    for key in data:
         if key not in ["parent_id", "name"]:
             raise errors.IrisettError("invalid monitor_group key %s" % key)
-        if key == "parent_id" and value:
-            if monitor_group_id == int(value):
-                raise errors.InvalidArguments("monitor group can't be its own parent")
-            if not await monitor_group_exists(dbcon, value):
-                raise errors.InvalidArguments("parent monitor group does not exist")
-        q = """update monitor_groups set %s=%%s where id=%%s""" % key
-        q_args = (value, monitor_group_id)
-        queries.append(q, q_args)
-    await dbcon.multi_operation(queries)
+    if not data:
+        return
+    keys = list(data)
+    q = """update monitor_groups set %s where id=%%s""" % ", ".join(
+        ["%s=%%s" % key for key in keys]
+    )
+    q_args = tuple(data[key] for key in keys) + (monitor_group_id,)
+    parent_id = data.get("parent_id")
+    if not parent_id:
+        await dbcon.operation(q, q_args)
+        return
+    if monitor_group_id == int(parent_id):
+        raise errors.InvalidArguments("monitor group can't be its own parent")
+    # Only update if the new parent exists. The parent lookup is wrapped in
+    # a derived table since MySQL doesn't allow selecting from the table
+    # being updated.
+    q += """ and exists (
+        select 1 from (select id from monitor_groups where id=%s) as parent)"""
+    q_args += (parent_id,)
+    if not await _rowcount_operation(dbcon, q, q_args):
+        # Nothing changed, either the parent is missing or the values
+        # were already set.
+        if not await monitor_group_exists(dbcon, parent_id):
+            raise errors.InvalidArguments("parent monitor group does not exist")
 
 
 async def delete_monitor_group(dbcon: DBConnection, monitor_group_id: int) -> None:
-    """Remove a monitor_group from the database."""
+    """Remove a monitor_group from the database.
 
+    All statements are sent as a single batch in one transaction.
+    """
+    q_args = (monitor_group_id,)
     queries = [
-        ("""delete from monitor_groups where id=%s""", (monitor_group_id,)),
-        (
-            """delete from monitor_group_active_monitors where monitor_group_id=%s""",
-            (monitor_group_id,),
-        ),
+        ("""delete from monitor_groups where id=%s""", q_args),
+        ("""delete from monitor_group_active_monitors where monitor_group_id=%s""", q_args),
+        ("""delete from monitor_group_contacts where monitor_group_id=%s""", q_args),
+        ("""delete from monitor_group_contact_groups where monitor_group_id=%s""", q_args),
         (
             """delete from object_metadata where object_type="monitor_group" and object_id=%s""",
-            (monitor_group_id,),
+            q_args,
         ),
     ]
     await dbcon.multi_operation(queries)
+    invalidate_exists(dbcon, "monitor_groups", [monitor_group_id])
+    contact.invalidate_cache()
+
+
+async def _rowcount_operation(dbcon: DBConnection, q: str, q_args: Tuple) -> int:
+    """Run a query and return the number of affected rows."""
+
+    async def _run(cur: Cursor) -> int:
+        await cur.execute(dbcon.prep_query(q), q_args)
+        return cur.rowcount
+
+    return await dbcon.transact(_run)
+
+
+async def _link_monitor_group(
+    dbcon: DBConnection,
+    link_table: str,
+    link_column: str,
+    object_table: str,
+    monitor_group_id: int,
+    object_id: int,
+) -> int:
+    """Link a monitor group to another object.
+
+    The link is only inserted if both the monitor group and the object
+    exist and they are not already linked. Returns the number of inserted
+    links.
+    """
+    q = """insert into {link_table} (monitor_group_id, {link_column})
+        select mg.id, obj.id from monitor_groups as mg, {object_table} as obj
+        where mg.id=%s and obj.id=%s and not exists (
+            select 1 from {link_table} where monitor_group_id=%s and {link_column}=%s)""".format(
+        link_table=link_table, link_column=link_column, object_table=object_table
+    )
+    q_args = (monitor_group_id, object_id, monitor_group_id, object_id)
+    return await _rowcount_operation(dbcon, q, q_args)
+
+
+async def _unlink_monitor_group(
+    dbcon: DBConnection,
+    link_table: str,
+    link_column: str,
+    monitor_group_id: int,
+    object_id: int,
+) -> int:
+    """Remove a link between a monitor group and another object.
+
+    Returns the number of removed links.
+    """
+    q = """delete from {link_table} where monitor_group_id=%s and {link_column}=%s""".format(
+        link_table=link_table, link_column=link_column
+    )
+    return await _rowcount_operation(dbcon, q, (monitor_group_id, object_id))
+
+
+async def _link_monitor_group_many(
+    dbcon: DBConnection,
+    link_table: str,
+    link_column: str,
+    monitor_group_id: int,
+    object_ids: List[int],
+) -> None:
+    """Link a monitor group to many objects.
+
+    The links are written using multi-row replace statements with up to
+    _LINK_CHUNK_SIZE rows each, all in one transaction. The caller must
+    check that the monitor group and objects exist.
+    """
+    queries = []  # type: List[Tuple[str, Tuple]]
+    for pos in range(0, len(object_ids), _LINK_CHUNK_SIZE):
+        chunk = object_ids[pos : pos + _LINK_CHUNK_SIZE]
+        q = """replace into {link_table} (monitor_group_id, {link_column}) values {values}""".format(
+            link_table=link_table,
+            link_column=link_column,
+            values=", ".join(["(%s, %s)"] * len(chunk)),
+        )
+        q_args = tuple(
+            value for object_id in chunk for value in (monitor_group_id, object_id)
+        )
+        queries.append((q, q_args))
+    if queries:
+        await dbcon.multi_operation(queries)
 
 
 async def add_active_monitor_to_monitor_group(
     dbcon: DBConnection, monitor_group_id: int, monitor_id: int
 ) -> None:
-    """Connect a monitor_group and an active monitor."""
-    if not await active_monitor_exists(dbcon, monitor_id):
+    """Connect a monitor_group and an active monitor.
+
+    The existence checks are only run when nothing was changed, to find
+    the right error message.
+    """
+    if not await _link_monitor_group(
+        dbcon,
+        "monitor_group_active_monitors",
+        "active_monitor_id",
+        "active_monitors",
+        monitor_group_id,
+        monitor_id,
+    ):
+        monitor_found, monitor_group_found = await bulk_exists(
+            dbcon,
+            [("active_monitors", monitor_id), ("monitor_groups", monitor_group_id)],
+        )
+        if not monitor_found:
+            raise errors.InvalidArguments("monitor does not exist")
+        if not monitor_group_found:
+            raise errors.InvalidArguments("monitor_group does not exist")
+    contact.invalidate_cache()
+
+
+async def add_active_monitors_to_monitor_group(
+    dbcon: DBConnection, monitor_group_id: int, monitor_ids: Iterable[int]
+) -> None:
+    """Connect a monitor_group and many active monitors."""
+    monitor_ids = sorted(set(monitor_ids))
+    if len(await active_monitors_exist(dbcon, monitor_ids)) != len(monitor_ids):
         raise errors.InvalidArguments("monitor does not exist")
     if not await monitor_group_exists(dbcon, monitor_group_id):
         raise errors.InvalidArguments("monitor_group does not exist")
-    q = """replace into monitor_group_active_monitors (monitor_group_id, active_monitor_id) values (%s, %s)"""
-    q_args = (monitor_group_id, monitor_id)
-    await dbcon.operation(q, q_args)
+    await _link_monitor_group_many(
+        dbcon,
+        "monitor_group_active_monitors",
+        "active_monitor_id",
+        monitor_group_id,
+        monitor_ids,
+    )
+    contact.invalidate_cache()
 
 
 async def delete_active_monitor_from_monitor_group(
     dbcon: DBConnection, monitor_group_id: int, monitor_id: int
 ) -> None:
     """Remove an active monitor from a monitor group."""
-    if not await active_monitor_exists(dbcon, monitor_id):
-        raise errors.InvalidArguments("monitor does not exist")
-    if not await monitor_group_exists(dbcon, monitor_group_id):
-        raise errors.InvalidArguments("monitor_group does not exist")
-    q = """delete from monitor_group_active_monitors where monitor_group_id=%s and active_monitor_id=%s"""
-    q_args = (monitor_group_id, monitor_id)
-    await dbcon.operation(q, q_args)
+    if not await _unlink_monitor_group(
+        dbcon,
+        "monitor_group_active_monitors",
+        "active_monitor_id",
+        monitor_group_id,
+        monitor_id,
+    ):
+        monitor_found, monitor_group_found = await bulk_exists(
+            dbcon,
+            [("active_monitors", monitor_id), ("monitor_groups", monitor_group_id)],
+        )
+        if not monitor_found:
+            raise errors.InvalidArguments("monitor does not exist")
+        if not monitor_group_found:
+            raise errors.InvalidArguments("monitor_group does not exist")
+    contact.invalidate_cache()
 
 
 async def add_contact_to_monitor_group(
     dbcon: DBConnection, monitor_group_id: int, contact_id: int
 ) -> None:
     """Connect a monitor_group and a contact."""
-    if not await contact_exists(dbcon, contact_id):
+    if not await _link_monitor_group(
+        dbcon,
+        "monitor_group_contacts",
+        "contact_id",
+        "contacts",
+        monitor_group_id,
+        contact_id,
+    ):
+        contact_found, monitor_group_found = await bulk_exists(
+            dbcon, [("contacts", contact_id), ("monitor_groups", monitor_group_id)]
+        )
+        if not contact_found:
+            raise errors.InvalidArguments("contact does not exist")
+        if not monitor_group_found:
+            raise errors.InvalidArguments("monitor_group does not exist")
+    contact.invalidate_cache()
+
+
+async def add_contacts_to_monitor_group(
+    dbcon: DBConnection, monitor_group_id: int, contact_ids: Iterable[int]
+) -> None:
+    """Connect a monitor_group and many contacts."""
+    contact_ids = sorted(set(contact_ids))
+    if len(await contacts_exist(dbcon, contact_ids)) != len(contact_ids):
         raise errors.InvalidArguments("contact does not exist")
     if not await monitor_group_exists(dbcon, monitor_group_id):
         raise errors.InvalidArguments("monitor_group does not exist")
-    q = """replace into monitor_group_contacts (monitor_group_id, contact_id) values (%s, %s)"""
-    q_args = (monitor_group_id, contact_id)
-    await dbcon.operation(q, q_args)
+    await _link_monitor_group_many(
+        dbcon, "monitor_group_contacts", "contact_id", monitor_group_id, contact_ids
+    )
+    contact.invalidate_cache()
 
 
 async def delete_contact_from_monitor_group(
     dbcon: DBConnection, monitor_group_id: int, contact_id: int
 ) -> None:
     """Remove a contact from a monitor group."""
-    if not await contact_exists(dbcon, contact_id):
-        raise errors.InvalidArguments("contact does not exist")
-    if not await monitor_group_exists(dbcon, monitor_group_id):
-        raise errors.InvalidArguments("monitor_group does not exist")
-    q = """delete from monitor_group_contacts where monitor_group_id=%s and contact_id=%s"""
-    q_args = (monitor_group_id, contact_id)
-    await dbcon.operation(q, q_args)
+    if not await _unlink_monitor_group(
+        dbcon, "monitor_group_contacts", "contact_id", monitor_group_id, contact_id
+    ):
+        contact_found, monitor_group_found = await bulk_exists(
+            dbcon, [("contacts", contact_id), ("monitor_groups", monitor_group_id)]
+        )
+        if not contact_found:
+            raise errors.InvalidArguments("contact does not exist")
+        if not monitor_group_found:
+            raise errors.InvalidArguments("monitor_group does not exist")
+    contact.invalidate_cache()
 
 
 async def add_contact_group_to_monitor_group(
     dbcon: DBConnection, monitor_group_id: int, contact_group_id: int
 ) -> None:
     """Connect a monitor_group and a contact group."""
-    if not await contact_group_exists(dbcon, contact_group_id):
+    if not await _link_monitor_group(
+        dbcon,
+        "monitor_group_contact_groups",
+        "contact_group_id",
+        "contact_groups",
+        monitor_group_id,
+        contact_group_id,
+    ):
+        contact_group_found, monitor_group_found = await bulk_exists(
+            dbcon,
+            [
+                ("contact_groups", contact_group_id),
+                ("monitor_groups", monitor_group_id),
+            ],
+        )
+        if not contact_group_found:
+            raise errors.InvalidArguments("contact group does not exist")
+        if not monitor_group_found:
+            raise errors.InvalidArguments("monitor_group does not exist")
+    contact.invalidate_cache()
+
+
+async def add_contact_groups_to_monitor_group(
+    dbcon: DBConnection, monitor_group_id: int, contact_group_ids: Iterable[int]
+) -> None:
+    """Connect a monitor_group and many contact groups."""
+    contact_group_ids = sorted(set(contact_group_ids))
+    if len(await contact_groups_exist(dbcon, contact_group_ids)) != len(
+        contact_group_ids
+    ):
         raise errors.InvalidArguments("contact group does not exist")
     if not await monitor_group_exists(dbcon, monitor_group_id):
         raise errors.InvalidArguments("monitor_group does not exist")
-    q = """replace into monitor_group_contact_groups (monitor_group_id, contact_group_id) values (%s, %s)"""
-    q_args = (monitor_group_id, contact_group_id)
-    await dbcon.operation(q, q_args)
+    await _link_monitor_group_many(
+        dbcon,
+        "monitor_group_contact_groups",
+        "contact_group_id",
+        monitor_group_id,
+        contact_group_ids,
+    )
+    contact.invalidate_cache()
 
 
 async def delete_contact_group_from_monitor_group(
     dbcon: DBConnection, monitor_group_id: int, contact_group_id: int
 ) -> None:
     """Remove a contact group from a monitor group."""
-    if not await contact_group_exists(dbcon, contact_group_id):
-        raise errors.InvalidArguments("contact does not exist")
-    if not await monitor_group_exists(dbcon, monitor_group_id):
-        raise errors.InvalidArguments("monitor_group does not exist")
-    q = """delete from monitor_group_contact_groups where monitor_group_id=%s and contact_group_id=%s"""
-    q_args = (monitor_group_id, contact_group_id)
-    await dbcon.operation(q, q_args)
+    if not await _unlink_monitor_group(
+        dbcon,
+        "monitor_group_contact_groups",
+        "contact_group_id",
+        monitor_group_id,
+        contact_group_id,
+    ):
+        contact_group_found, monitor_group_found = await bulk_exists(
+            dbcon,
+            [
+                ("contact_groups", contact_group_id),
+                ("monitor_groups", monitor_group_id),
+            ],
+        )
+        if not contact_group_found:
+            raise errors.InvalidArguments("contact does not exist")
+        if not monitor_group_found:
+            raise errors.InvalidArguments("monitor_group does not exist")
+    contact.invalidate_cache()
 
 
 async def get_all_monitor_groups(
     dbcon: DBConnection,
 ) -> Iterable[object_models.MonitorGroup]:
-    q = """select id, parent_id, name from monitor_groups"""
-    ret = [object_models.MonitorGroup(*row) for row in await dbcon.fetch_all(q)]
+    ret = list(
+        starmap(object_models.MonitorGroup, await dbcon.fetch_all(_SELECT_GROUPS_SQL))
+    )
     return ret
 
 
 async def get_monitor_group(
     dbcon: DBConnection, id: int
 ) -> Any:  # Use any because optional returns suck.
-    q = """select id, parent_id, name from monitor_groups where id=%s"""
-    row = await dbcon.fetch_row(q, (id,))
+    row = await dbcon.fetch_row(_SELECT_GROUP_SQL, (id,))
     ret = None
     if row:
         ret = object_models.MonitorGroup(*row)
@@ -176,56 +434,65 @@ async def get_monitor_group(
 async def get_contacts_for_monitor_group(
     dbcon: DBConnection, id: int
 ) -> Iterable[object_models.Contact]:
-    q = """select contacts.id, contacts.name, contacts.email, contacts.phone, contacts.active
-            from contacts, monitor_group_contacts
-            where contacts.id=monitor_group_contacts.contact_id
-            and monitor_group_contacts.monitor_group_id=%s"""
-    return [object_models.Contact(*row) for row in await dbcon.fetch_all(q, (id,))]
+    rows = await dbcon.fetch_all(_SELECT_GROUP_CONTACTS_SQL, (id,))
+    return list(starmap(object_models.Contact, rows))
 
 
 async def get_contact_groups_for_monitor_group(
     dbcon: DBConnection, id: int
 ) -> Iterable[object_models.ContactGroup]:
-    q = """select cg.id, cg.name, cg.active
-            from contact_groups as cg, monitor_group_contact_groups
-            where cg.id=monitor_group_contact_groups.contact_group_id
-            and monitor_group_contact_groups.monitor_group_id=%s"""
-    return [object_models.ContactGroup(*row) for row in await dbcon.fetch_all(q, (id,))]
+    rows = await dbcon.fetch_all(_SELECT_GROUP_CONTACT_GROUPS_SQL, (id,))
+    return list(starmap(object_models.ContactGroup, rows))
 
 
 async def get_active_monitors_for_monitor_group(
     dbcon: DBConnection, id: int
 ) -> Iterable[object_models.ActiveMonitor]:
-    q = """select mon.id, mon.def_id, mon.state, mon.state_ts, mon.msg, mon.alert_id, mon.deleted,
-            mon.checks_enabled, mon.alerts_enabled
-            from active_monitors as mon, monitor_group_active_monitors
-            where mon.id=monitor_group_active_monitors.active_monitor_id
-            and monitor_group_active_monitors.monitor_group_id=%s"""
-    return [
-        object_models.ActiveMonitor(*row) for row in await dbcon.fetch_all(q, (id,))
-    ]
+    rows = await dbcon.fetch_all(_SELECT_GROUP_ACTIVE_MONITORS_SQL, (id,))
+    return list(starmap(object_models.ActiveMonitor, rows))
+
+
+async def get_active_monitor_ids_for_monitor_group(
+    dbcon: DBConnection, id: int
+) -> List[int]:
+    """Get the ids of the active monitors in a monitor group.
+
+    The active_monitors table isn't joined, the ids may include monitors
+    that have been removed.
+    """
+    rows = await dbcon.fetch_all(_SELECT_GROUP_ACTIVE_MONITOR_IDS_SQL, (id,))
+    return [row[0] for row in rows]
+
+
+async def get_monitor_group_bundle(
+    dbcon: DBConnection, id: int
+) -> Tuple[
+    Iterable[object_models.Contact],
+    Iterable[object_models.ContactGroup],
+    Iterable[object_models.ActiveMonitor],
+]:
+    """Get the contacts, contact groups and active monitors for a monitor group.
+
+    The queries are independent and are run concurrently.
+    """
+    contacts, contact_groups, active_monitors = await asyncio.gather(
+        get_contacts_for_monitor_group(dbcon, id),
+        get_contact_groups_for_monitor_group(dbcon, id),
+        get_active_monitors_for_monitor_group(dbcon, id),
+    )
+    return contacts, contact_groups, active_monitors
 
 
 async def get_monitor_groups_for_metadata(
     dbcon: DBConnection, meta_key: str, meta_value: str
 ) -> Iterable[object_models.MonitorGroup]:
-    q = """select mg.id, mg.parent_id, mg.name
-        from monitor_groups as mg, object_metadata as meta
-        where meta.key=%s and meta.value=%s and meta.object_type="monitor_group" and meta.object_id=mg.id"""
     q_args = (meta_key, meta_value)
-    return [
-        object_models.MonitorGroup(*row) for row in await dbcon.fetch_all(q, q_args)
-    ]
+    rows = await dbcon.fetch_all(_SELECT_GROUPS_FOR_METADATA_SQL, q_args)
+    return list(starmap(object_models.MonitorGroup, rows))
 
 
 async def get_active_monitor_metadata_for_monitor_group(
     dbcon: DBConnection, id: int
 ) -> Iterable[object_models.ObjectMetadata]:
-    q = '''select metadata.object_type, metadata.object_id, metadata.key, metadata.value
-            from monitor_group_active_monitors, object_metadata as metadata
-            where monitor_group_active_monitors.monitor_group_id=%s and
-            metadata.object_id=monitor_group_active_monitors.active_monitor_id
-            and metadata.object_type="active_monitor"'''
-    return [
-        object_models.ObjectMetadata(*row) for row in await dbcon.fetch_all(q, (id,))
-    ]
+    rows = await dbcon.fetch_all(_SELECT_GROUP_MONITOR_METADATA_SQL, (id,))
+    return list(starmap(object_models.ObjectMetadata, rows))
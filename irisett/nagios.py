@@ -8,10 +8,9 @@ a result for the check. The text output is separated from the performance
 data output. Nothing more is currently done with the performance data.
 """
 
-from typing import List, Tuple, Union, cast
+from typing import Dict, List, Tuple
 import asyncio.subprocess
-
-from irisett import log
+import shutil
 
 
 class NagiosError(Exception):
@@ -27,21 +26,40 @@ STATUS_WARNING = 1
 STATUS_CRITICAL = 2
 STATUS_UNKNOWN = 3
 
+# Resolved absolute paths for plugin executables.
+_executable_paths = {}  # type: Dict[str, str]
+
+
+def _resolve_executable(executable: str) -> str:
+    """Find the absolute path of a plugin executable.
+
+    Successful lookups are cached so the PATH doesn't need to be searched
+    for every check. Failed lookups are not cached, the plugin may be
+    installed later.
+    """
+    path = _executable_paths.get(executable)
+    if path is None:
+        path = shutil.which(executable)
+        if path is None:
+            raise NagiosError("executable not found")
+        _executable_paths[executable] = path
+    return path
+
 
 # noinspection PyUnusedLocal
 async def run_plugin(
     executable: str, args: List[str], timeout: int
-) -> Tuple[str, List[str]]:
-    run_args = [executable] + args
+) -> Tuple[str, List[bytes]]:
+    run_args = (_resolve_executable(executable), *args)
     try:
         proc = await asyncio.create_subprocess_exec(
             *run_args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
         )
     except FileNotFoundError:
         raise NagiosError("executable not found")
-    stdin_data, stderr_data = await proc.communicate()
-    std_data = stdin_data + stderr_data
-    await proc.wait()
+    stdout_data, stderr_data = await proc.communicate()
+    # communicate() waits for the process to exit, returncode is set.
+    std_data = stdout_data + stderr_data if stderr_data else stdout_data
     if proc.returncode not in [STATUS_OK, STATUS_WARNING, STATUS_CRITICAL]:
         raise MonitorFailedError(std_data)
     text, perf = parse_plugin_output(std_data)
@@ -50,29 +68,32 @@ async def run_plugin(
     return text, perf
 
 
-def parse_plugin_output(output: Union[str, bytes]) -> Tuple[str, List[str]]:
+def parse_plugin_output(output: bytes) -> Tuple[str, List[bytes]]:
     """Parse nagios output.
 
     Splits the data into a text string and performance data.
-    """
-    output = decode_plugin_output(output)
-    if "|" not in output:
-        text = output
-        perf = []  # type: List[str]
-    else:
-        text, _perf = output.split("|", 1)
-        perf = _perf.split("|")
-    text = text.strip()
-    return text, perf
-
+    The first line may contain text and performance data separated by a |.
+    Following lines are long text output until a line containing a |,
+    the rest of that line and all remaining lines are performance data.
 
-def decode_plugin_output(output: Union[str, bytes]) -> str:
-    """Decode nagios output from latin-1."""
-    try:
-        if type(output) == bytes:
-            output = cast(bytes, output)
-            output = output.decode("latin-1", "replace")
-    except Exception as e:
-        log.debug("nagios.encode_monitor_output: error: %s" % str(e))
-        output = ""
-    return cast(str, output)
+    The output is split as bytes and only the text is decoded, the
+    performance data is returned undecoded.
+    """
+    first_line, _, rest = output.partition(b"\n")
+    text, sep, perf_data = first_line.partition(b"|")
+    perf = [perf_data.strip()] if sep else []  # type: List[bytes]
+    long_text, sep, perf_data = rest.partition(b"|")
+    if sep:
+        perf += [line.strip() for line in perf_data.split(b"\n") if line.strip()]
+    long_text = long_text.strip()
+    if long_text:
+        text = text.strip() + b"\n" + long_text
+    return decode_plugin_output(text.strip()), perf
+
+
+def decode_plugin_output(output: bytes) -> str:
+    """Decode nagios output from latin-1.
+
+    Decoding latin-1 can't fail, every byte maps to a character.
+    """
+    return output.decode("latin-1")
@@ -0,0 +1,21 @@
+"""A shared jinja environment for notification templates.
+
+Notification templates are compiled once when the settings are parsed,
+using a single environment avoids creating a new environment for every
+template and disables template reload checks.
+"""
+
+import functools
+import jinja2
+
+ENV = jinja2.Environment(auto_reload=False, cache_size=400)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(source: str) -> jinja2.Template:
+    """Compile a notification template.
+
+    Identical template sources share the same template object, this lets
+    NotificationManager render them only once per notification.
+    """
+    return ENV.from_string(source)
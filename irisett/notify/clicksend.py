@@ -1,15 +1,20 @@
 from typing import Dict, Any, Iterable, Optional, List
 import aiohttp
-import json
-import jinja2
 
 from irisett import log
+from irisett.utils import json_dumps
+from irisett.notify._jinja_env import compile_template
 
 CLICKSEND_URL = "https://rest.clicksend.com/v3/sms/send"
 
 
 async def send_sms(
-    recipients: Iterable[str], msg: str, username: str, api_key: str, sender: str
+    session: aiohttp.ClientSession,
+    recipients: Iterable[str],
+    msg: str,
+    username: str,
+    api_key: str,
+    sender: str,
 ):
     data = {
         "messages": [],
@@ -25,19 +30,19 @@ async def send_sms(
             }
         )
     try:
-        async with aiohttp.ClientSession(
+        async with session.post(
+            CLICKSEND_URL,
+            data=json_dumps(data),
             headers={"Content-Type": "application/json"},
             auth=aiohttp.BasicAuth(username, api_key),
-        ) as session:
-            async with session.post(
-                CLICKSEND_URL, data=json.dumps(data), timeout=30
-            ) as resp:
-                if resp.status != 200:
-                    log.msg(
-                        "Error sending clicksend sms notification: http status %s"
-                        % (str(resp.status)),
-                        "NOTIFICATION",
-                    )
+            timeout=30,
+        ) as resp:
+            if resp.status != 200:
+                log.msg(
+                    "Error sending clicksend sms notification: http status %s"
+                    % (str(resp.status)),
+                    "NOTIFICATION",
+                )
     except aiohttp.ClientError as e:
         log.msg(
             "Error sending clicksend sms notification: %s" % (str(e)), "NOTIFICATIONS"
@@ -63,5 +68,5 @@ def parse_settings(config: Any) -> Optional[Dict[str, Any]]:
         ret = None
     else:
         log.debug("Valid SMS notification settings found", "NOTIFICATIONS")
-        ret["tmpl"] = jinja2.Template(ret["tmpl"])
+        ret["tmpl"] = compile_template(ret["tmpl"])
     return ret
@@ -2,7 +2,6 @@
 
 from typing import Optional, Dict, Any, Union, Iterable
 import aiosmtplib
-import jinja2
 from email import charset
 
 charset.add_charset("utf-8", charset.SHORTEST, charset.QP)  # type: ignore
@@ -12,6 +11,7 @@ import asyncio
 
 # noinspection PyPep8
 from irisett import log
+from irisett.notify._jinja_env import compile_template
 
 
 async def send_email(
@@ -29,18 +29,29 @@ async def send_email(
     """
     if type(mail_to) == str:
         mail_to = [mail_to]
+    # The message is built once and only the To header is replaced for
+    # each recipient, all messages are sent over the same smtp session.
+    msg = MIMEText(body)
+    msg["Subject"] = subject
+    msg["From"] = mail_from
     smtp = aiosmtplib.SMTP(hostname=server, port=25, loop=loop)
     try:
         await smtp.connect()
+    except aiosmtplib.errors.SMTPException as e:
+        log.msg("Error sending smtp notification: %s" % (str(e)), "NOTIFICATIONS")
+        return
+    try:
         for rcpt in mail_to:
-            msg = MIMEText(body)
-            msg["Subject"] = subject
-            msg["From"] = mail_from
+            del msg["To"]
             msg["To"] = rcpt
             await smtp.send_message(msg)
-        await smtp.quit()
     except aiosmtplib.errors.SMTPException as e:
         log.msg("Error sending smtp notification: %s" % (str(e)), "NOTIFICATIONS")
+    finally:
+        try:
+            await smtp.quit()
+        except aiosmtplib.errors.SMTPException:
+            pass
 
 
 async def send_alert_notification(
@@ -48,9 +59,19 @@ async def send_alert_notification(
     settings: Dict[str, Any],
     recipients: Iterable[str],
     tmpl_args: Dict[str, Any],
+    *,
+    subject: Optional[str] = None,
+    body: Optional[str] = None,
 ) -> None:
-    subject = settings["tmpl-subject"].render(**tmpl_args)
-    body = settings["tmpl-body"].render(**tmpl_args)
+    """Send an alert notification email.
+
+    subject and body are rendered from the settings templates unless
+    already rendered strings are passed in.
+    """
+    if subject is None:
+        subject = settings["tmpl-subject"].render(**tmpl_args)
+    if body is None:
+        body = settings["tmpl-body"].render(**tmpl_args)
     await send_email(
         loop, settings["sender"], recipients, subject, body, settings["server"]
     )
@@ -76,6 +97,6 @@ def parse_settings(config: Any) -> Optional[Dict[str, Any]]:
         ret = None
     else:
         log.debug("Valid email notification settings found", "NOTIFICATIONS")
-        ret["tmpl-subject"] = jinja2.Template(ret["tmpl-subject"])
-        ret["tmpl-body"] = jinja2.Template(ret["tmpl-body"])
+        ret["tmpl-subject"] = compile_template(ret["tmpl-subject"])
+        ret["tmpl-body"] = compile_template(ret["tmpl-body"])
     return ret
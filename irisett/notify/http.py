@@ -1,26 +1,33 @@
 from typing import Any, Optional, Dict, Iterable
 import aiohttp
-import json
 
 from irisett import log
+from irisett.utils import json_dumps
 
 
-async def send_http_notification(url: str, in_data: Any):
-    out_data = json.dumps(in_data)
+async def send_http_notification(
+    session: aiohttp.ClientSession, url: str, in_data: Any
+):
+    out_data = json_dumps(in_data)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=out_data, timeout=10) as resp:
-                if resp.status != 200:
-                    log.msg(
-                        "Error sending http notification: http status %s"
-                        % (str(resp.status)),
-                        "NOTIFICATION",
-                    )
+        async with session.post(
+            url,
+            data=out_data,
+            headers={"Content-Type": "application/json"},
+            timeout=10,
+        ) as resp:
+            if resp.status != 200:
+                log.msg(
+                    "Error sending http notification: http status %s"
+                    % (str(resp.status)),
+                    "NOTIFICATION",
+                )
     except aiohttp.ClientError as e:
         log.msg("Error sending http notification: %s" % (str(e)), "NOTIFICATIONS")
 
 
 async def send_alert_notification(
+    session: aiohttp.ClientSession,
     settings: Dict[str, Any],
     email_recipients: Iterable[str],
     sms_recipients: Iterable[str],
@@ -32,7 +39,7 @@ async def send_alert_notification(
         "data": tmpl_args,
     }
 
-    await send_http_notification(settings["url"], data)
+    await send_http_notification(session, settings["url"], data)
 
 
 def parse_settings(config: Any) -> Optional[Dict[str, Any]]:
@@ -1,7 +1,8 @@
-from typing import Dict, Iterable, Any, List
+from typing import Dict, Iterable, Any, List, Optional, Tuple
 import asyncio
+import aiohttp
 
-from irisett import log
+from irisett import log, stats
 from irisett.notify import (
     email,
     http,
@@ -10,11 +11,19 @@ from irisett.notify import (
     slack,
 )
 
+# Identical notifications sent within this many seconds are dropped.
+NOTIFY_DEDUP_TTL = 5
+NOTIFY_DEDUP_SIZE = 1024
+
 
 # noinspection PyMethodMayBeStatic
 class NotificationManager:
     def __init__(self, config: Any, *, loop: asyncio.AbstractEventLoop = None) -> None:
         self.loop = loop or asyncio.get_event_loop()
+        self._session = None  # type: Optional[aiohttp.ClientSession]
+        # (channel, recipients, message) -> expiry time.
+        self._recent_notifications = {}  # type: Dict[Tuple, float]
+        stats.set("duplicate_notifications", 0, "NOTIFICATIONS")
         if not config:
             log.msg(
                 "Missing config section, no alert notification will be sent",
@@ -30,25 +39,129 @@ class NotificationManager:
             self.sms_settings = sms.parse_settings(config)
             self.slack_settings = slack.parse_settings(config)
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """A http client session shared by all outgoing notifications.
+
+        Reusing the session keeps connections to the notification
+        services alive between alerts. It is created on first use so that
+        it is bound to the running event loop.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=50, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        """Close the shared http client session, call at shutdown."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _is_duplicate(self, key: Tuple) -> bool:
+        """Check if an identical notification was sent recently.
+
+        When many monitors change state at once they may produce the same
+        notification, only the first one is sent.
+        """
+        now = self.loop.time()
+        recent = self._recent_notifications
+        if len(recent) >= NOTIFY_DEDUP_SIZE:
+            recent = {k: v for k, v in recent.items() if v > now}
+            if len(recent) >= NOTIFY_DEDUP_SIZE:
+                recent = {}
+            self._recent_notifications = recent
+        expires = recent.get(key)
+        if expires is not None and expires > now:
+            stats.inc("duplicate_notifications", "NOTIFICATIONS")
+            return True
+        recent[key] = now + NOTIFY_DEDUP_TTL
+        return False
+
     async def send_notification(
         self, recipient_dict: Dict[str, Any], tmpl_args: Dict[str, Any]
     ) -> bool:
         email_recipients = list(recipient_dict["email"])
         sms_recipients = list(recipient_dict["phone"])
-        if email_recipients and self.email_settings:
-            await email.send_alert_notification(
-                self.loop, self.email_settings, email_recipients, tmpl_args
-            )
-        if sms_recipients and self.sms_settings:
-            await sms.send_alert_notification(
-                self.sms_settings, sms_recipients, tmpl_args
-            )
-        if self.http_settings:
-            await http.send_alert_notification(
-                self.http_settings, email_recipients, sms_recipients, tmpl_args
+        # Templates with the same source share a template object, render
+        # each of them only once even if several channels use them.
+        rendered = {}  # type: Dict[int, str]
+
+        def render(tmpl: Any) -> Optional[str]:
+            if not tmpl:
+                return None
+            key = id(tmpl)
+            if key not in rendered:
+                rendered[key] = tmpl.render(**tmpl_args)
+            return rendered[key]
+
+        # Settings and the http session are bound to locals once instead of
+        # being looked up for every channel.
+        email_settings = self.email_settings
+        sms_settings = self.sms_settings
+        http_settings = self.http_settings
+        slack_settings = self.slack_settings
+        session = None
+        if sms_settings or http_settings or slack_settings:
+            session = self.session
+        # The notification channels are independent of each other, send
+        # them concurrently so a slow service doesn't delay the others.
+        # Identical notifications sent within a few seconds are dropped,
+        # the raw http callbacks are always sent.
+        jobs = []
+        if email_recipients and email_settings:
+            subject = render(email_settings["tmpl-subject"])
+            body = render(email_settings["tmpl-body"])
+            email_key = ("email", tuple(email_recipients), subject, body)
+            if not self._is_duplicate(email_key):
+                jobs.append(
+                    email.send_alert_notification(
+                        self.loop,
+                        email_settings,
+                        email_recipients,
+                        tmpl_args,
+                        subject=subject,
+                        body=body,
+                    )
+                )
+        if sms_recipients and sms_settings:
+            sms_msg = render(sms_settings["tmpl"])
+            if not self._is_duplicate(("sms", tuple(sms_recipients), sms_msg)):
+                jobs.append(
+                    sms.send_alert_notification(
+                        session, sms_settings, sms_recipients, tmpl_args, msg=sms_msg
+                    )
+                )
+        if http_settings:
+            jobs.append(
+                http.send_alert_notification(
+                    session, http_settings, email_recipients, sms_recipients, tmpl_args
+                )
             )
-        if self.slack_settings:
-            await slack.send_alert_notification(self.slack_settings, tmpl_args)
+        if slack_settings:
+            slack_msg = render(slack_settings["tmpl-msg"])
+            duration = render(slack_settings["tmpl-duration"])
+            url = render(slack_settings["tmpl-url"])
+            if not self._is_duplicate(("slack", slack_msg, duration, url)):
+                jobs.append(
+                    slack.send_alert_notification(
+                        session,
+                        slack_settings,
+                        tmpl_args,
+                        msg=slack_msg,
+                        duration=duration,
+                        url=url,
+                    )
+                )
+        if not jobs:
+            return True
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.msg(
+                    "Error sending alert notification: %s" % (str(result)),
+                    "NOTIFICATIONS",
+                )
         return True
 
     async def send_email(self, recipients: Iterable[str], subject: str, body: str):
@@ -68,6 +181,7 @@ class NotificationManager:
             return
         if self.sms_settings["provider"] == "clicksend":
             await clicksend.send_sms(
+                self.session,
                 recipients,
                 msg,
                 self.sms_settings["username"],
@@ -78,11 +192,13 @@ class NotificationManager:
     async def send_http_notification(self, data: Any) -> None:
         if not self.http_settings:
             return
-        await http.send_http_notification(self.http_settings["url"], data)
+        await http.send_http_notification(
+            self.session, self.http_settings["url"], data
+        )
 
     async def send_slack_notification(self, attachments: List[Dict]) -> None:
         if not self.slack_settings:
             return
         await slack.send_slack_notification(
-            self.slack_settings["webhook-url"], attachments
+            self.session, self.slack_settings["webhook-url"], attachments
         )
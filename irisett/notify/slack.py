@@ -1,49 +1,60 @@
 from typing import List, Dict, Optional, Any
 import aiohttp
-import json
-import jinja2
 
 from irisett import log
+from irisett.utils import json_dumps
+from irisett.notify._jinja_env import compile_template
 
 
-async def send_slack_notification(url: str, attachments: List[Dict]):
-    data = {"attachments": attachments}
+async def send_slack_notification(
+    session: aiohttp.ClientSession, url: str, attachments: List[Dict]
+):
+    data = json_dumps({"attachments": attachments})
+    headers = {"Content-Type": "application/json"}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=json.dumps(data), timeout=30) as resp:
-                if resp.status != 200:
-                    log.msg(
-                        "Error sending slack notification: http status %s"
-                        % (str(resp.status)),
-                        "NOTIFICATION",
-                    )
+        async with session.post(url, data=data, headers=headers, timeout=30) as resp:
+            if resp.status != 200:
+                log.msg(
+                    "Error sending slack notification: http status %s"
+                    % (str(resp.status)),
+                    "NOTIFICATION",
+                )
     except aiohttp.ClientError as e:
         log.msg("Error sending slack notification: %s" % (str(e)), "NOTIFICATIONS")
 
 
-async def send_alert_notification(settings: Dict, tmpl_args: Dict):
+async def send_alert_notification(
+    session: aiohttp.ClientSession,
+    settings: Dict,
+    tmpl_args: Dict,
+    *,
+    msg: Optional[str] = None,
+    duration: Optional[str] = None,
+    url: Optional[str] = None,
+):
+    """Send an alert notification to slack.
+
+    The message, duration and url are rendered from the settings templates
+    unless already rendered strings are passed in.
+    """
+    if msg is None:
+        msg = settings["tmpl-msg"].render(**tmpl_args)
+    if duration is None and settings["tmpl-duration"]:
+        duration = settings["tmpl-duration"].render(**tmpl_args)
+    if url is None and settings["tmpl-url"]:
+        url = settings["tmpl-url"].render(**tmpl_args)
     attachment = {
-        "fallback": settings["tmpl-msg"].render(**tmpl_args),
+        "fallback": msg,
         "fields": [],
-    }
+    }  # type: Dict[str, Any]
     attachment["pretext"] = attachment["fallback"]
-    if settings["tmpl-duration"]:
-        attachment["fields"].append(
-            {
-                "title": "Duration",
-                "value": settings["tmpl-duration"].render(**tmpl_args),
-                "short": False,
-            }
-        )
-    if settings["tmpl-url"]:
+    if duration is not None:
         attachment["fields"].append(
-            {
-                "title": "URL",
-                "value": settings["tmpl-url"].render(**tmpl_args),
-                "short": False,
-            }
+            {"title": "Duration", "value": duration, "short": False}
         )
-    await send_slack_notification(settings["webhook-url"], [attachment])
+    if url is not None:
+        attachment["fields"].append({"title": "URL", "value": url, "short": False})
+    await send_slack_notification(session, settings["webhook-url"], [attachment])
 
 
 def parse_settings(config: Any) -> Optional[Dict[str, Any]]:
@@ -61,9 +72,9 @@ def parse_settings(config: Any) -> Optional[Dict[str, Any]]:
         ret = None
     else:
         log.debug("Valid slack notification settings found", "NOTIFICATIONS")
-        ret["tmpl-msg"] = jinja2.Template(ret["tmpl-msg"])
+        ret["tmpl-msg"] = compile_template(ret["tmpl-msg"])
         if ret["tmpl-duration"]:
-            ret["tmpl-duration"] = jinja2.Template(ret["tmpl-duration"])
+            ret["tmpl-duration"] = compile_template(ret["tmpl-duration"])
         if ret["tmpl-url"]:
-            ret["tmpl-url"] = jinja2.Template(ret["tmpl-url"])
+            ret["tmpl-url"] = compile_template(ret["tmpl-url"])
     return ret
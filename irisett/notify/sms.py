@@ -1,4 +1,5 @@
 from typing import Dict, Any, Optional, Iterable
+import aiohttp
 
 from irisett import log
 from irisett.notify import clicksend
@@ -25,11 +26,18 @@ def parse_settings(config: Any) -> Optional[Dict[str, Any]]:
 
 
 async def send_alert_notification(
-    settings: Dict[str, Any], recipients: Iterable[str], tmpl_args: Dict[str, Any]
+    session: aiohttp.ClientSession,
+    settings: Dict[str, Any],
+    recipients: Iterable[str],
+    tmpl_args: Dict[str, Any],
+    *,
+    msg: Optional[str] = None,
 ):
     if settings["provider"] == "clicksend":
-        msg = settings["tmpl"].render(**tmpl_args)
+        if msg is None:
+            msg = settings["tmpl"].render(**tmpl_args)
         await clicksend.send_sms(
+            session,
             recipients,
             msg,
             settings["username"],
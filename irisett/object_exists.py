@@ -2,40 +2,142 @@
 
 This whole module is a big workaround to avoid circular imports.
 This should probaby be cleaned up in some way.
+
+Positive results are cached for EXISTS_CACHE_TTL seconds since the same
+ids tend to be checked repeatedly, for example when linking many objects
+to one monitor group. Functions that delete objects must call
+invalidate_exists. Negative results are never cached, a missing object
+may be created at any time.
 """
 
-from typing import Optional, Iterable
+from typing import Iterable, Dict, Tuple, Set, List
+import time
+
 from irisett.sql import DBConnection
 
+EXISTS_CACHE_TTL = 30
+EXISTS_CACHE_SIZE = 4096
+
+# (id(dbcon), table, object id) -> expiry time.
+_exists_cache = {}  # type: Dict[Tuple[int, str, int], float]
+
+
+def _cache_exists(dbcon: DBConnection, table: str, object_id: int) -> None:
+    if len(_exists_cache) >= EXISTS_CACHE_SIZE:
+        _exists_cache.clear()
+    _exists_cache[(id(dbcon), table, object_id)] = time.monotonic() + EXISTS_CACHE_TTL
+
 
-async def _object_exists(
-    dbcon: DBConnection, query: str, query_args: Optional[Iterable]
-) -> bool:
-    res = await dbcon.fetch_single(query, query_args)
-    if res == 0:
+def invalidate_exists(
+    dbcon: DBConnection, table: str, object_ids: Iterable[int]
+) -> None:
+    """Remove deleted objects from the exists cache."""
+    for object_id in object_ids:
+        _exists_cache.pop((id(dbcon), table, object_id), None)
+
+
+async def _object_exists(dbcon: DBConnection, table: str, object_id: int) -> bool:
+    expires = _exists_cache.get((id(dbcon), table, object_id))
+    if expires is not None and expires > time.monotonic():
+        return True
+    # exists stops at the first matching row, unlike count.
+    q = """select exists(select 1 from %s where id=%%s)""" % table
+    res = await dbcon.fetch_scalar(q, (object_id,))
+    if not res:
         return False
+    _cache_exists(dbcon, table, object_id)
     return True
 
 
+async def bulk_exists(
+    dbcon: DBConnection, specs: List[Tuple[str, int]]
+) -> List[bool]:
+    """Check if several objects exist using a single query.
+
+    specs is a list of (table, object id) tuples, a list of booleans in the
+    same order is returned. Cached objects are not included in the query.
+    """
+    ret = [False] * len(specs)
+    now = time.monotonic()
+    pending = []
+    for n, (table, object_id) in enumerate(specs):
+        expires = _exists_cache.get((id(dbcon), table, object_id))
+        if expires is not None and expires > now:
+            ret[n] = True
+        else:
+            pending.append(n)
+    if not pending:
+        return ret
+    # Each row includes its position in specs so the result doesn't depend
+    # on the row order of the union.
+    q = " union all ".join(
+        "select %d, exists(select 1 from %s where id=%%s)" % (n, specs[n][0])
+        for n in pending
+    )
+    q_args = tuple(specs[n][1] for n in pending)
+    for n, res in await dbcon.fetch_all(q, q_args):
+        if res:
+            ret[n] = True
+            _cache_exists(dbcon, *specs[n])
+    return ret
+
+
+async def _objects_exist(
+    dbcon: DBConnection, table: str, object_ids: Iterable[int]
+) -> Set[int]:
+    """Return the subset of object_ids that exist, using a single query."""
+    object_ids = set(object_ids)
+    if not object_ids:
+        return set()
+    placeholders = ", ".join(["%s"] * len(object_ids))
+    q = """select id from %s where id in (%s)""" % (table, placeholders)
+    ret = {row[0] for row in await dbcon.fetch_all(q, tuple(object_ids))}
+    for object_id in ret:
+        _cache_exists(dbcon, table, object_id)
+    return ret
+
+
 async def monitor_group_exists(dbcon: DBConnection, monitor_group_id: int) -> bool:
     """Check if a monitor group id exists."""
-    q = """select count(id) from monitor_groups where id=%s"""
-    return await _object_exists(dbcon, q, (monitor_group_id,))
+    return await _object_exists(dbcon, "monitor_groups", monitor_group_id)
 
 
 async def contact_exists(dbcon: DBConnection, contact_id: int) -> bool:
     """Check if a contact id exists."""
-    q = """select count(id) from contacts where id=%s"""
-    return await _object_exists(dbcon, q, (contact_id,))
+    return await _object_exists(dbcon, "contacts", contact_id)
 
 
 async def active_monitor_exists(dbcon: DBConnection, active_monitor_id: int) -> bool:
     """Check if a contact id exists."""
-    q = """select count(id) from active_monitors where id=%s"""
-    return await _object_exists(dbcon, q, (active_monitor_id,))
+    return await _object_exists(dbcon, "active_monitors", active_monitor_id)
 
 
 async def contact_group_exists(dbcon: DBConnection, contact_group_id: int) -> bool:
     """Check if a contact group id exists."""
-    q = """select count(id) from contact_groups where id=%s"""
-    return await _object_exists(dbcon, q, (contact_group_id,))
+    return await _object_exists(dbcon, "contact_groups", contact_group_id)
+
+
+async def monitor_groups_exist(
+    dbcon: DBConnection, monitor_group_ids: Iterable[int]
+) -> Set[int]:
+    """Get the monitor group ids from a list that exist."""
+    return await _objects_exist(dbcon, "monitor_groups", monitor_group_ids)
+
+
+async def contacts_exist(dbcon: DBConnection, contact_ids: Iterable[int]) -> Set[int]:
+    """Get the contact ids from a list that exist."""
+    return await _objects_exist(dbcon, "contacts", contact_ids)
+
+
+async def active_monitors_exist(
+    dbcon: DBConnection, active_monitor_ids: Iterable[int]
+) -> Set[int]:
+    """Get the active monitor ids from a list that exist."""
+    return await _objects_exist(dbcon, "active_monitors", active_monitor_ids)
+
+
+async def contact_groups_exist(
+    dbcon: DBConnection, contact_group_ids: Iterable[int]
+) -> Set[int]:
+    """Get the contact group ids from a list that exist."""
+    return await _objects_exist(dbcon, "contact_groups", contact_group_ids)
@@ -6,11 +6,16 @@ This modules uses the attrs module to define models for Irisett objects
 The model definitions should exactly match the attributes and order of the
 objects in the database.
 
+Models use slotted classes to keep per-instance memory down, except for
+ActiveMonitorAlert, ActiveMonitorDef and ActiveMonitorResult which get
+extra attributes (monitor/args/ts_time) assigned by the web views.
+
 NOTE: typing for this module is done in object_models.pyi due to
 how the dynamic nature of the attr module interacts with mypy.
 """
 
-from typing import Iterable, Any, List, Tuple
+from typing import Iterable, Any, List, Tuple, Dict, Callable
+from operator import attrgetter
 
 # noinspection PyPackageRequirements
 import attr
@@ -19,13 +24,33 @@ import attr
 from attr import asdict
 
 
+# Insert value getters per model class, see insert_values.
+_insert_getters = {}  # type: Dict[type, Callable[[Any], Tuple]]
+
+
 def insert_values(object: Any) -> Tuple:
     """Get values appropriate for inserting into the DB.
 
     Use this as the query arguments for a plain insert of an object into
     the standard irisett DB.
+
+    A getter for the insert values is built once per model class instead
+    of walking the attrs fields on every call.
     """
-    return attr.astuple(object, filter=insert_filter)
+    getter = _insert_getters.get(type(object))
+    if getter is None:
+        getter = _insert_getters[type(object)] = _make_insert_getter(type(object))
+    return getter(object)
+
+
+def _make_insert_getter(cls: type) -> Callable[[Any], Tuple]:
+    names = [a.name for a in attr.fields(cls) if insert_filter(a, None)]
+    if not names:
+        return lambda obj: ()
+    if len(names) == 1:
+        single_getter = attrgetter(names[0])
+        return lambda obj: (single_getter(obj),)
+    return attrgetter(*names)
 
 
 def list_asdict(in_list: Iterable[Any]) -> List[Any]:
@@ -44,7 +69,7 @@ def insert_filter(attribute: Any, value: Any) -> bool:
     return True
 
 
-@attr.s
+@attr.s(slots=True)
 class Contact:
     id = attr.ib()
     name = attr.ib()
@@ -54,7 +79,7 @@ class Contact:
     model_type = "contact"
 
 
-@attr.s
+@attr.s(slots=True)
 class ContactGroup:
     id = attr.ib()
     name = attr.ib()
@@ -62,7 +87,7 @@ class ContactGroup:
     model_type = "contact_group"
 
 
-@attr.s
+@attr.s(slots=True)
 class ActiveMonitor:
     id = attr.ib()
     def_id = attr.ib()
@@ -78,7 +103,7 @@ class ActiveMonitor:
     model_type = "active_monitor"
 
 
-@attr.s
+@attr.s(slots=True)
 class ActiveMonitorArg:
     id = attr.ib()
     monitor_id = attr.ib()
@@ -109,7 +134,7 @@ class ActiveMonitorDef:
     model_type = "active_monitor_arg"
 
 
-@attr.s
+@attr.s(slots=True)
 class ActiveMonitorDefArg:
     id = attr.ib()
     active_monitor_def_id = attr.ib()
@@ -121,7 +146,7 @@ class ActiveMonitorDefArg:
     model_type = "active_monitor_def_arg"
 
 
-@attr.s
+@attr.s(slots=True)
 class ObjectMetadata:
     object_type = attr.ib()
     object_id = attr.ib()
@@ -130,7 +155,7 @@ class ObjectMetadata:
     model_type = "object_metadata"
 
 
-@attr.s
+@attr.s(slots=True)
 class ObjectBindata:
     object_type = attr.ib()
     object_id = attr.ib()
@@ -139,7 +164,7 @@ class ObjectBindata:
     model_type = "object_bindata"
 
 
-@attr.s
+@attr.s(slots=True)
 class MonitorGroup:
     id = attr.ib()
     parent_id = attr.ib()
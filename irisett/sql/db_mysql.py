@@ -4,10 +4,16 @@ Provides a connection to a database and convenience functions for accessing
 it.
 """
 
-from typing import Optional, Iterable, Any, List, Callable
+from typing import Optional, Iterable, Any, List, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import aiomysql
 
+try:
+    import MySQLdb
+except ImportError:
+    MySQLdb = None
+
 from irisett import (
     log,
     stats,
@@ -17,6 +23,28 @@ from irisett.sql import mysql_data as sql_data
 import irisett.sql.base
 
 
+def _group_queries(queries) -> List[Tuple[str, List]]:
+    """Group consecutive queries with the same sql.
+
+    Returns a list of (query, [args, ...]) tuples, the order of the queries
+    is kept. Plain query strings are not grouped, they are run with None
+    as args so any % in them is left alone.
+    """
+    ret = []  # type: List[Tuple[str, List]]
+    for _query in queries:
+        if isinstance(_query, str):
+            query = _query
+            args = None  # type: Any
+        else:
+            query = _query[0]
+            args = _query[1]
+        if args is not None and ret and ret[-1][0] == query and ret[-1][1][0]:
+            ret[-1][1].append(args)
+        else:
+            ret.append((query, [args]))
+    return ret
+
+
 class DBConnection(irisett.sql.base.DBConnection):
     """A sql connection manager."""
 
@@ -27,13 +55,25 @@ class DBConnection(irisett.sql.base.DBConnection):
         passwd: str,
         dbname: str,
         loop: asyncio.AbstractEventLoop = None,
+        *,
+        pool_minsize: int = 5,
+        pool_maxsize: int = 20,
+        pool_recycle: int = 3600,
     ) -> None:
         self.loop = loop or asyncio.get_event_loop()
         self.host = host
         self.user = user
         self.passwd = passwd
         self.dbname = dbname
+        self.pool_minsize = pool_minsize
+        self.pool_maxsize = pool_maxsize
+        self.pool_recycle = pool_recycle
         self.pool = None  # type: Any
+        self._db_version = None  # type: Optional[int]
+        # Threads for the blocking MySQLdb queries run by fetch_all_fast.
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        if MySQLdb:
+            self._executor = ThreadPoolExecutor(max_workers=2)
         stats.set("queries", 0, "SQL")
         stats.set("transactions", 0, "SQL")
 
@@ -45,26 +85,32 @@ class DBConnection(irisett.sql.base.DBConnection):
         Creates a connection pool using aiomysql and initializes the database
         if necessary.
         """
-        self.pool = await aiomysql.create_pool(
+        # The database is checked and created using a single connection
+        # without an active database, the long lived pool is then created
+        # with the database selected. The pool keeps a number of connections
+        # open so queries don't have to wait for new connections to be
+        # established.
+        conn = await aiomysql.connect(
             host=self.host, user=self.user, password=self.passwd, loop=self.loop
         )
-        if reset_db:
-            await self._drop_db()
-        db_exists = await self._check_db_exists()
-        if not db_exists:
-            await self._create_db()
-            db_initialized = False
-        else:
-            db_initialized = await self._check_db_initialized()
-        # We close the pool and create a new one because aiomysql doesn't
-        # provide an easy way to change the active database for an entire
-        # pool, just individual connections.
-        self.pool.terminate()
+        try:
+            async with conn.cursor() as cur:
+                if reset_db:
+                    await self._drop_db(cur)
+                db_exists, db_initialized = await self._check_db_state(cur)
+                if not db_exists:
+                    await self._create_db(cur)
+                    db_initialized = False
+        finally:
+            conn.close()
         self.pool = await aiomysql.create_pool(
             host=self.host,
             user=self.user,
             password=self.passwd,
             db=self.dbname,
+            minsize=self.pool_minsize,
+            maxsize=self.pool_maxsize,
+            pool_recycle=self.pool_recycle,
             loop=self.loop,
         )
         if not db_initialized:
@@ -73,6 +119,10 @@ class DBConnection(irisett.sql.base.DBConnection):
         log.msg("Database initialized")
 
     async def close(self) -> None:
+        if self._executor:
+            self._executor.shutdown()
+        if self.pool is None:
+            return
         self.pool.terminate()
         await self.pool.wait_closed()
 
@@ -80,71 +130,62 @@ class DBConnection(irisett.sql.base.DBConnection):
         """Preps query to work with multiple sql module param styles."""
         return query
 
-    async def _drop_db(self) -> None:
+    async def _drop_db(self, cur: Any) -> None:
         log.msg("Removing database %s" % self.dbname)
         q = """DROP DATABASE %s""" % self.dbname
-        await self.operation(q)
+        await cur.execute(q)
 
-    async def _create_db(self) -> None:
+    async def _create_db(self, cur: Any) -> None:
         # Yes yes, this risks sql injection, but the dbname is from the
         # irisett config file, so if you want to sql inject yourself,
         # go ahead.
         log.msg("Creating missing database %s" % self.dbname)
         q = """CREATE DATABASE %s""" % self.dbname
-        await self.operation(q)
+        await cur.execute(q)
 
     async def _init_db(self, only_init_tables: bool) -> None:
         log.msg("Initializing empty database")
         commands = sql_data.SQL_ALL
         if only_init_tables:
             commands = sql_data.SQL_BARE
-        for command in commands:
-            await self.operation(command)
-
-    async def _check_db_exists(self) -> bool:
-        """Check if the database exists."""
-        q = """SELECT SCHEMA_NAME
-            FROM INFORMATION_SCHEMA.SCHEMATA
-            WHERE SCHEMA_NAME = %s"""
-        res = await self.fetch_single(q, (self.dbname,))
-        if not res:
-            return False
-        return True
-
-    async def _check_db_initialized(self) -> bool:
-        """Check if the database has been initialized."""
-        q = """SELECT count(*)
-        FROM information_schema.TABLES
-        WHERE (TABLE_SCHEMA = %s) AND (TABLE_NAME = %s)"""
-        res = await self.fetch_single(q, (self.dbname, "version"))
-        if res == 0:
-            return False
-        return True
+        await self.multi_operation(commands)
+
+    async def _check_db_state(self, cur: Any) -> Tuple[bool, bool]:
+        """Check if the database exists and has been initialized."""
+        q = """SELECT
+            (SELECT count(*) FROM INFORMATION_SCHEMA.SCHEMATA
+                WHERE SCHEMA_NAME = %s),
+            (SELECT count(*) FROM INFORMATION_SCHEMA.TABLES
+                WHERE (TABLE_SCHEMA = %s) AND (TABLE_NAME = %s))"""
+        await cur.execute(q, (self.dbname, self.dbname, "version"))
+        db_exists, db_initialized = await cur.fetchone()
+        return bool(db_exists), bool(db_initialized)
 
     async def _upgrade_db(self) -> None:
         """Upgrade to a newer database version if required.
 
-        Loops through the commands in sql_data.SQL_UPGRADES and runs them.
+        Runs the commands in sql_data.SQL_UPGRADES, one batch per version.
         """
         cur_version = await self._get_db_version()
         for n in range(cur_version + 1, sql_data.CUR_VERSION + 1):
             log.msg("Upgrading database to version %d" % n)
             if n in sql_data.SQL_UPGRADES:
-                for command in sql_data.SQL_UPGRADES[n]:
-                    await self.operation(command)
+                await self.multi_operation(sql_data.SQL_UPGRADES[n])
         if cur_version != sql_data.CUR_VERSION:
             await self._set_db_version(sql_data.CUR_VERSION)
 
     async def _get_db_version(self) -> int:
-        q = """select version from version limit 1"""
-        str_version = await self.fetch_single(q)
-        version = int(str_version)
-        return version
+        if self._db_version is None:
+            q = """select version from version limit 1"""
+            str_version = await self.fetch_scalar(q)
+            self._db_version = int(str_version)
+        return self._db_version
 
     async def _set_db_version(self, version: int):
         q = """update version set version=%s"""
         q_args = (version,)
         await self.operation(q, q_args)
+        self._db_version = version
 
     async def fetch_all(self, query: str, args: Optional[Iterable] = None) -> List:
         """Run a query and fetch all returned rows."""
@@ -155,6 +196,42 @@ class DBConnection(irisett.sql.base.DBConnection):
                 ret = await cur.fetchall()
         return ret
 
+    def _sync_fetch_all(self, query: str, args: Optional[Iterable]) -> List:
+        """Run a query using a blocking MySQLdb connection.
+
+        Called from the executor threads. A new connection is used for each
+        query, so there are no idle connections to time out or go stale
+        between the (rare) large queries.
+        """
+        conn = MySQLdb.connect(
+            host=self.host, user=self.user, passwd=self.passwd, db=self.dbname
+        )
+        try:
+            cur = conn.cursor()
+            cur.execute(query, args)
+            ret = list(cur.fetchall())
+            cur.close()
+        finally:
+            conn.close()
+        return ret
+
+    async def fetch_all_fast(
+        self, query: str, args: Optional[Iterable] = None
+    ) -> List:
+        """Run a query and fetch all returned rows, for large result sets.
+
+        If mysqlclient (MySQLdb) is installed the query is run in a thread
+        using its C protocol parser, which is a lot faster than the pure
+        python parser used by aiomysql for many rows. Otherwise this is the
+        same as fetch_all.
+        """
+        if not self._executor:
+            return await self.fetch_all(query, args)
+        stats.inc("queries", "SQL")
+        return await self.loop.run_in_executor(
+            self._executor, self._sync_fetch_all, query, args
+        )
+
     async def fetch_row(self, query: str, args: Optional[Iterable] = None) -> List:
         """Run a query and fetch a single returned row."""
         stats.inc("queries", "SQL")
@@ -172,14 +249,24 @@ class DBConnection(irisett.sql.base.DBConnection):
             ret = res[0]
         return ret
 
-    async def count_rows(self, query: str, args: Optional[Iterable] = None) -> float:
+    async def fetch_scalar(self, query: str, args: Optional[Iterable] = None) -> Any:
+        """Run a single column query and fetch the value from the first row.
+
+        Returns None if no row was returned.
+        """
+        res = await self.fetch_row(query, args)
+        if not res:
+            return None
+        return res[0]
+
+    async def count_rows(self, query: str, args: Optional[Iterable] = None) -> int:
         """Count the number of returned rows for a query.
 
-        This is not equivalent to select count(*), this will actually fetch
-        all the rows then count them and is thus much slower.
+        The query is wrapped in a select count(*) so the rows are counted by
+        the database instead of being fetched.
         """
-        res = await self.fetch_all(query, args)
-        return len(res)
+        q = "select count(*) from (%s) as _t" % query.strip().rstrip(";")
+        return await self.fetch_single(q, args)
 
     async def operation(self, query: str, args: Optional[Iterable] = None) -> Any:
         """Run a sql operation (query).
@@ -196,19 +283,20 @@ class DBConnection(irisett.sql.base.DBConnection):
         return ret
 
     async def multi_operation(self, queries) -> Any:
-        """Run multiple sql operations as a transaction."""
+        """Run multiple sql operations as a transaction.
+
+        Consecutive queries with the same sql are run using executemany,
+        which sends multi row inserts as a single statement.
+        """
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cur:
-                for _query in queries:
-                    if type(_query) == str:
-                        query = _query
-                        args = []
+                for query, args_list in _group_queries(queries):
+                    if len(args_list) == 1:
+                        await cur.execute(query, args_list[0])
                     else:
-                        query = _query[0]
-                        args = _query[1]
-                    stats.inc("queries", "SQL")
-                    await cur.execute(query, args)
+                        await cur.executemany(query, args_list)
                 await conn.commit()
+        stats.inc("queries", "SQL", len(queries))
 
     async def transact(
         self, func: Callable[..., Any], *args: Any, **kwargs: Any
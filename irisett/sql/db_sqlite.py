@@ -4,8 +4,10 @@ Provides a connection to a database and convenience functions for accessing
 it.
 """
 
-from typing import Optional, Iterable, Any, List, Callable
+from typing import Optional, Iterable, Any, List, Tuple, Callable, AsyncIterator
 import asyncio
+import contextlib
+import functools
 import aiosqlite
 import os
 import os.path
@@ -20,12 +22,98 @@ from irisett.sql import sqlite_data as sql_data
 import irisett.sql.base
 
 
+@functools.lru_cache(maxsize=512)
+def _prep_query(query: str) -> str:
+    return query.replace("%s", "?")
+
+
+# Number of compiled statements sqlite keeps per connection, the default
+# of 100 is less than the number of distinct queries irisett runs.
+SQLITE_CACHED_STATEMENTS = 256
+
+# Filenames that open a private in-memory database for each connection.
+MEMORY_FILENAMES = ("", ":memory:")
+
+
+async def _connect(filename: str) -> Any:
+    db = await aiosqlite.connect(
+        filename,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+    )
+    for pragma in sql_data.SQL_PRAGMAS:
+        cur = await db.execute(pragma)
+        await cur.close()
+    return db
+
+
+def _prep_queries(queries) -> List[Tuple[str, Any]]:
+    """Convert a list of query strings or (query, args) tuples.
+
+    Returns a list of (prepped query, args) tuples.
+    """
+    return [
+        (_prep_query(q), ()) if isinstance(q, str) else (_prep_query(q[0]), q[1])
+        for q in queries
+    ]
+
+
+class _SqlitePool:
+    """A pool of aiosqlite connections used for reads.
+
+    With the database in WAL mode readers don't block the writer or each
+    other.
+    """
+
+    def __init__(self, filename: str, size: int) -> None:
+        self.filename = filename
+        self.size = size
+        self._connections = []  # type: List[Any]
+        self._queue = asyncio.Queue()  # type: asyncio.Queue
+
+    async def open(self) -> None:
+        for _ in range(self.size):
+            db = await _connect(self.filename)
+            self._connections.append(db)
+            self._queue.put_nowait(db)
+
+    async def acquire(self) -> Any:
+        return await self._queue.get()
+
+    def release(self, db: Any) -> None:
+        self._queue.put_nowait(db)
+
+    async def close(self) -> None:
+        for db in self._connections:
+            await db.close()
+        self._connections = []
+
+
 class DBConnection(irisett.sql.base.DBConnection):
     """A sqlite connection manager."""
 
-    def __init__(self, filename: str, loop: asyncio.AbstractEventLoop = None) -> None:
+    def __init__(
+        self,
+        filename: str,
+        loop: asyncio.AbstractEventLoop = None,
+        *,
+        read_pool_size: int = 4,
+    ) -> None:
         self.filename = filename
         self.loop = loop or asyncio.get_event_loop()
+        # All writes use a single connection, sqlite only allows a single
+        # writer. The lock keeps statements from different coroutines from
+        # being mixed into each others transactions. Reads use a pool of
+        # connections, except for in-memory databases where every
+        # connection would get its own empty database, reads then use the
+        # writer connection.
+        self._db = None  # type: Any
+        self._db_version = None  # type: Optional[int]
+        self._lock = asyncio.Lock()
+        self._in_memory = filename in MEMORY_FILENAMES
+        if self._in_memory:
+            read_pool_size = 0
+        self._readers = _SqlitePool(filename, read_pool_size)
         stats.set("queries", 0, "SQL")
         stats.set("transactions", 0, "SQL")
         sqlite3.register_adapter(bool, int)
@@ -36,7 +124,7 @@ class DBConnection(irisett.sql.base.DBConnection):
     ):
         """Initialize the DBConnection.
 
-        Creates a connection pool using aiosqlite and initializes the database
+        Opens a connection using aiosqlite and initializes the database
         if necessary.
         """
         if reset_db:
@@ -45,17 +133,38 @@ class DBConnection(irisett.sql.base.DBConnection):
         db_exists = False
         if os.path.isfile(self.filename):
             db_exists = True
+        self._db = await _connect(self.filename)
         if not db_exists:
             await self._init_db(only_init_tables)
+        await self._readers.open()
         await self._upgrade_db()
         log.msg("Database initialized")
 
     async def close(self) -> None:
-        pass
+        await self._readers.close()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    @contextlib.asynccontextmanager
+    async def _reader(self) -> AsyncIterator[Any]:
+        """Get a connection to run a read query on."""
+        if self._in_memory:
+            async with self._lock:
+                yield self._db
+            return
+        db = await self._readers.acquire()
+        try:
+            yield db
+        finally:
+            self._readers.release(db)
 
     def prep_query(self, query: str) -> str:
-        """Preps query to work with multiple sql module param styles."""
-        return query.replace("%s", "?")
+        """Preps query to work with multiple sql module param styles.
+
+        Queries are mostly module constants, so conversions are cached.
+        """
+        return _prep_query(query)
 
     async def _init_db(self, only_init_tables: bool) -> None:
         log.msg("Initializing empty database")
@@ -67,46 +176,63 @@ class DBConnection(irisett.sql.base.DBConnection):
     async def _upgrade_db(self) -> None:
         """Upgrade to a newer database version if required.
 
-        Loops through the commands in sql_data.SQL_UPGRADES and runs them.
+        Runs the commands in sql_data.SQL_UPGRADES, one batch per version.
         """
         cur_version = await self._get_db_version()
         for n in range(cur_version + 1, sql_data.CUR_VERSION + 1):
             log.msg("Upgrading database to version %d" % n)
             if n in sql_data.SQL_UPGRADES:
-                for command in sql_data.SQL_UPGRADES[n]:
-                    await self.operation(command)
+                await self.multi_operation(sql_data.SQL_UPGRADES[n])
         if cur_version != sql_data.CUR_VERSION:
             await self._set_db_version(sql_data.CUR_VERSION)
 
     async def _get_db_version(self) -> int:
-        q = """select version from version limit 1"""
-        str_version = await self.fetch_single(q)
-        version = int(str_version)
-        return version
+        """Get the database version.
+
+        The version is kept in both the version table and the sqlite
+        user_version header field, which can be read without touching any
+        tables. Databases created before user_version was used get it set
+        from the version table.
+        """
+        if self._db_version is None:
+            version = await self.fetch_scalar("""PRAGMA user_version""")
+            if not version:
+                q = """select version from version limit 1"""
+                version = int(await self.fetch_scalar(q))
+                await self.operation("""PRAGMA user_version=%d""" % version)
+            self._db_version = version
+        return self._db_version
 
     async def _set_db_version(self, version: int):
         q = """update version set version=%s"""
         q_args = (version,)
-        await self.operation(q, q_args)
+        queries = [(q, q_args), """PRAGMA user_version=%d""" % version]
+        await self.multi_operation(queries)
+        self._db_version = version
 
     async def fetch_all(self, query: str, args: Optional[Iterable] = None) -> List:
         """Run a query and fetch all returned rows."""
         stats.inc("queries", "SQL")
         query = self.prep_query(query)
-        async with aiosqlite.connect(
-            self.filename, detect_types=sqlite3.PARSE_DECLTYPES
-        ) as db:
+        async with self._reader() as db:
             async with db.execute(query, args) as cur:
                 ret = await cur.fetchall()
         return ret
 
+    async def fetch_all_fast(
+        self, query: str, args: Optional[Iterable] = None
+    ) -> List:
+        """Run a query and fetch all returned rows, for large result sets.
+
+        Same as fetch_all for sqlite.
+        """
+        return await self.fetch_all(query, args)
+
     async def fetch_row(self, query: str, args: Optional[Iterable] = None) -> List:
         """Run a query and fetch a single returned row."""
         stats.inc("queries", "SQL")
         query = self.prep_query(query)
-        async with aiosqlite.connect(
-            self.filename, detect_types=sqlite3.PARSE_DECLTYPES
-        ) as db:
+        async with self._reader() as db:
             async with db.execute(query, args) as cur:
                 ret = await cur.fetchone()
         return ret
@@ -119,14 +245,24 @@ class DBConnection(irisett.sql.base.DBConnection):
             ret = res[0]
         return ret
 
-    async def count_rows(self, query: str, args: Optional[Iterable] = None) -> float:
+    async def fetch_scalar(self, query: str, args: Optional[Iterable] = None) -> Any:
+        """Run a single column query and fetch the value from the first row.
+
+        Returns None if no row was returned.
+        """
+        res = await self.fetch_row(query, args)
+        if not res:
+            return None
+        return res[0]
+
+    async def count_rows(self, query: str, args: Optional[Iterable] = None) -> int:
         """Count the number of returned rows for a query.
 
-        This is not equivalent to select count(*), this will actually fetch
-        all the rows then count them and is thus much slower.
+        The query is wrapped in a select count(*) so the rows are counted by
+        the database instead of being fetched.
         """
-        res = await self.fetch_all(query, args)
-        return len(res)
+        q = "select count(*) from (%s) as _t" % query.strip().rstrip(";")
+        return await self.fetch_single(q, args)
 
     async def operation(self, query: str, args: Optional[Iterable] = None) -> Any:
         """Run a sql operation (query).
@@ -136,31 +272,33 @@ class DBConnection(irisett.sql.base.DBConnection):
         """
         stats.inc("queries", "SQL")
         query = self.prep_query(query)
-        async with aiosqlite.connect(
-            self.filename, detect_types=sqlite3.PARSE_DECLTYPES
-        ) as db:
-            cur = await db.execute(query, args)
+        async with self._lock:
+            cur = await self._db.execute(query, args)
             ret = cur.lastrowid
             await cur.close()
-            await db.commit()
+            await self._db.commit()
         return ret
 
     async def multi_operation(self, queries) -> Any:
-        """Run multiple sql operations as a transaction."""
-        async with aiosqlite.connect(
-            self.filename, detect_types=sqlite3.PARSE_DECLTYPES
-        ) as db:
-            async with db.cursor() as cur:
-                for _query in queries:
-                    if type(_query) == str:
-                        query = _query
-                        args = []
-                    else:
-                        query = _query[0]
-                        args = _query[1]
-                    stats.inc("queries", "SQL")
-                    await cur.execute(self.prep_query(query), args)
-                await db.commit()
+        """Run multiple sql operations as a transaction.
+
+        The transaction is started explicitly, the sqlite3 module only
+        starts one implicitly before dml statements so schema statements
+        would otherwise each be committed (and synced) separately.
+        """
+        queries = _prep_queries(queries)
+        async with self._lock:
+            async with self._db.cursor() as cur:
+                try:
+                    await cur.execute("BEGIN IMMEDIATE")
+                    for query, args in queries:
+                        await cur.execute(query, args)
+                except:
+                    await self._db.rollback()
+                    raise
+                else:
+                    await self._db.commit()
+        stats.inc("queries", "SQL", len(queries))
 
     async def transact(
         self, func: Callable[..., Any], *args: Any, **kwargs: Any
@@ -170,18 +308,17 @@ class DBConnection(irisett.sql.base.DBConnection):
         This can be used to simulate transactions.
         commit will be called when the callback returns. If an exception is
         raised in the callback a rollback is performed.
+        The callback must not run other queries through the DBConnection,
+        the connection is locked until it returns.
         """
         stats.inc("transactions", "SQL")
-        async with aiosqlite.connect(
-            self.filename, detect_types=sqlite3.PARSE_DECLTYPES
-        ) as db:
-            async with db.cursor() as cur:
+        async with self._lock:
+            async with self._db.cursor() as cur:
                 try:
                     ret = await func(cur, *args, **kwargs)
-                    await cur.close()
                 except:
-                    await db.rollback()
+                    await self._db.rollback()
                     raise
                 else:
-                    await db.commit()
+                    await self._db.commit()
         return ret
@@ -6,7 +6,7 @@ irisett starts up.
 
 # The current active version of the database, increase when making changes
 # and create upgrade queries in SQL_UPGRADES below.
-CUR_VERSION = 8
+CUR_VERSION = 11
 
 SQL_VERSION = [
     """insert into version (version) values ('%s')""" % str(CUR_VERSION),
@@ -33,7 +33,8 @@ SQL_TABLES = [
             `checks_enabled` boolean NOT NULL DEFAULT true,
             `alerts_enabled` boolean NOT NULL DEFAULT true,
             `alias` VARCHAR(50) NULL,
-            PRIMARY KEY (`id`)
+            PRIMARY KEY (`id`),
+            KEY `deleted_id_idx` (`deleted`, `id`)
         )
         """,
     """
@@ -68,7 +69,7 @@ SQL_TABLES = [
             `state` varchar(10) NOT NULL,
             `result_msg` varchar(200) not null,
             primary key (`id`),
-            key `monitor_id_idx` (`monitor_id`)
+            key `monitor_id_ts_idx` (`monitor_id`, `timestamp`),
             key `timestamp_idx` (`timestamp`)
         )
         """,
@@ -155,7 +156,7 @@ SQL_TABLES = [
             `value` varchar(100) not null,
             PRIMARY KEY (`object_type`, `object_id`, `key`),
             KEY `type_id_idx` (`object_type`, `object_id`),
-            KEY `key_value_idx` (`key`, `value`)
+            KEY `key_value_type_id_idx` (`key`, `value`, `object_type`, `object_id`)
         )
         """,
     """
@@ -324,4 +325,13 @@ SQL_UPGRADES = {
     8: [
         """ALTER TABLE `active_monitors` ADD `alias` varchar(50) NULL AFTER `alerts_enabled`""",
     ],
+    9: [
+        """ALTER TABLE `object_metadata` DROP INDEX `key_value_idx`, ADD INDEX `key_value_type_id_idx` (`key`, `value`, `object_type`, `object_id`)""",
+    ],
+    10: [
+        """ALTER TABLE `active_monitor_results` DROP INDEX `monitor_id_idx`, ADD INDEX `monitor_id_ts_idx` (`monitor_id`, `timestamp`)""",
+    ],
+    11: [
+        """ALTER TABLE `active_monitors` ADD INDEX `deleted_id_idx` (`deleted`, `id`)""",
+    ],
 }
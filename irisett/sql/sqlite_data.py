@@ -6,7 +6,21 @@ irisett starts up.
 
 # The current active version of the database, increase when making changes
 # and create upgrade queries in SQL_UPGRADES below.
-CUR_VERSION = 4
+CUR_VERSION = 7
+
+# Run on every new connection before any other statement. The journal mode
+# is stored in the database file, WAL lets the read connections read while
+# the writer is writing. The other settings are per connection: a 64MB page
+# cache, 256MB of memory mapped I/O, temporary tables in memory and a wait
+# for locks instead of failing immediately.
+SQL_PRAGMAS = [
+    """PRAGMA journal_mode=WAL""",
+    """PRAGMA synchronous=NORMAL""",
+    """PRAGMA cache_size=-65536""",
+    """PRAGMA mmap_size=268435456""",
+    """PRAGMA temp_store=MEMORY""",
+    """PRAGMA busy_timeout=5000""",
+]
 
 SQL_VERSION = [
     """insert into version (version) values ('%s')""" % str(CUR_VERSION),
@@ -44,9 +58,6 @@ SQL_TABLES = [
             value varchar(100)
         )
         """,
-    """
-        CREATE INDEX active_monitor_args_monitor_id_idx ON active_monitor_args(monitor_id)
-        """,
     """
         create table active_monitor_alerts
         (
@@ -64,12 +75,9 @@ SQL_TABLES = [
             `monitor_id` int not null,
             `timestamp` int not null,
             `state` varchar(10) not null,
-            `result_msg` varchar(200) not null,
+            `result_msg` varchar(200) not null
         )
         """,
-    """
-        CREATE INDEX active_monitor_alerts_monitor_id_idx ON active_monitor_alerts(monitor_id)
-        """,
     """
         create table active_monitor_defs
         (
@@ -94,9 +102,6 @@ SQL_TABLES = [
             default_value varchar(50)
         )
         """,
-    """
-        CREATE INDEX monitor_def_id_idx ON active_monitor_def_args(active_monitor_def_id)
-        """,
     """
         create table active_monitor_contacts
         (
@@ -105,9 +110,6 @@ SQL_TABLES = [
             PRIMARY KEY (`active_monitor_id`, `contact_id`)
         )
         """,
-    """
-        CREATE INDEX monitor_def_monitor_id_idx ON active_monitor_contacts(active_monitor_id)
-        """,
     """
         create table active_monitor_contact_groups
         (
@@ -116,9 +118,6 @@ SQL_TABLES = [
             PRIMARY KEY (`active_monitor_id`, `contact_group_id`)
         )
         """,
-    """
-        CREATE INDEX monitor_id_idx ON active_monitor_contact_groups(active_monitor_id)
-        """,
     """
         create table contacts
         (
@@ -145,9 +144,6 @@ SQL_TABLES = [
             PRIMARY KEY (`contact_group_id`, `contact_id`)
         )
         """,
-    """
-        CREATE INDEX contact_group_id_idx ON contact_group_contacts(contact_group_id)
-        """,
     """
         create table object_metadata
         (
@@ -158,12 +154,6 @@ SQL_TABLES = [
             PRIMARY KEY (`object_type`, `object_id`, `key`)
         )
         """,
-    """
-        CREATE INDEX object_metadata_type_id_idx ON object_metadata(object_type, object_id)
-        """,
-    """
-        CREATE INDEX key_value_idx ON object_metadata(key, value)
-        """,
     """
         create table object_bindata
         (
@@ -174,9 +164,6 @@ SQL_TABLES = [
             PRIMARY KEY (`object_type`, `object_id`, `key`)
         )
         """,
-    """
-        CREATE INDEX object_bindata_type_id_idx ON object_bindata(object_type, object_id)
-        """,
     """
         create table monitor_groups
         (
@@ -185,12 +172,6 @@ SQL_TABLES = [
             `name` varchar(100)
         )
         """,
-    """
-        CREATE INDEX parent_idx ON monitor_groups(parent_id)
-        """,
-    """
-        CREATE INDEX name_idx ON monitor_groups(name)
-        """,
     """
         create table monitor_group_active_monitors
         (
@@ -199,12 +180,6 @@ SQL_TABLES = [
             PRIMARY KEY (`monitor_group_id`, `active_monitor_id`)
         )
         """,
-    """
-        CREATE INDEX monitor_group_active_monitors_monitor_group_id_idx ON monitor_group_active_monitors(monitor_group_id)
-        """,
-    """
-        CREATE INDEX active_monitor_id_idx ON monitor_group_active_monitors(active_monitor_id)
-        """,
     """
         create table monitor_group_contacts
         (
@@ -213,9 +188,6 @@ SQL_TABLES = [
             PRIMARY KEY (`monitor_group_id`, `contact_id`)
         )
         """,
-    """
-        CREATE INDEX monitor_group_contacts_monitor_group_id_idx ON monitor_group_contacts(monitor_group_id)
-        """,
     """
         create table monitor_group_contact_groups
         (
@@ -224,13 +196,68 @@ SQL_TABLES = [
             PRIMARY KEY (`monitor_group_id`, `contact_group_id`)
         )
         """,
+]
+# Indexes are created after the tables have been filled.
+# noinspection PyPep8
+SQL_INDEXES = [
+    """
+        CREATE INDEX active_monitors_deleted_id_idx ON active_monitors(deleted, id)
+        """,
+    """
+        CREATE INDEX active_monitor_args_monitor_id_idx ON active_monitor_args(monitor_id)
+        """,
+    """
+        CREATE INDEX active_monitor_results_monitor_id_ts_idx ON active_monitor_results(monitor_id, timestamp)
+        """,
+    """
+        CREATE INDEX active_monitor_results_timestamp_idx ON active_monitor_results(timestamp)
+        """,
+    """
+        CREATE INDEX active_monitor_alerts_monitor_id_idx ON active_monitor_alerts(monitor_id)
+        """,
+    """
+        CREATE INDEX monitor_def_id_idx ON active_monitor_def_args(active_monitor_def_id)
+        """,
+    """
+        CREATE INDEX monitor_def_monitor_id_idx ON active_monitor_contacts(active_monitor_id)
+        """,
+    """
+        CREATE INDEX monitor_id_idx ON active_monitor_contact_groups(active_monitor_id)
+        """,
+    """
+        CREATE INDEX contact_group_id_idx ON contact_group_contacts(contact_group_id)
+        """,
+    """
+        CREATE INDEX object_metadata_type_id_idx ON object_metadata(object_type, object_id)
+        """,
+    """
+        CREATE INDEX key_value_type_id_idx ON object_metadata(key, value, object_type, object_id)
+        """,
+    """
+        CREATE INDEX object_bindata_type_id_idx ON object_bindata(object_type, object_id)
+        """,
+    """
+        CREATE INDEX parent_idx ON monitor_groups(parent_id)
+        """,
+    """
+        CREATE INDEX name_idx ON monitor_groups(name)
+        """,
+    """
+        CREATE INDEX monitor_group_active_monitors_monitor_group_id_idx ON monitor_group_active_monitors(monitor_group_id)
+        """,
+    """
+        CREATE INDEX active_monitor_id_idx ON monitor_group_active_monitors(active_monitor_id)
+        """,
+    """
+        CREATE INDEX monitor_group_contacts_monitor_group_id_idx ON monitor_group_contacts(monitor_group_id)
+        """,
     """
         CREATE INDEX monitor_group_contact_groups_monitor_group_id_idx ON monitor_group_contact_groups(monitor_group_id)
         """,
 ]
 SQL_MONITOR_DEFS = [
-    """insert into active_monitor_defs (name, description, active, cmdline_filename,
-        cmdline_args_tmpl, description_tmpl)
+    """insert into active_monitor_defs
+        (name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl)
         values (
             "Ping monitor",
             "Monitor an IP using ICMP echo request packets.",
@@ -238,61 +265,37 @@ SQL_MONITOR_DEFS = [
             "/usr/lib/nagios/plugins/check_ping",
             "-H {{hostname}} -w {{rtt}},{{pl}}% -c {{rtt}},{{pl}}%",
             "Ping monitor for {{hostname}}"
-            )
-        """,
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (1, "hostname", "IP address", "IP to monitor", 1, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (1, "rtt", "Max round trip time", "The maximum permitted round trip time in miliseconds", 0, "500")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (1, "pl", "Max packet loss", "The maximum permitted packet loss in percent", 0, "50")""",
-    """insert into active_monitor_defs
-        (name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl) values (
+        ), (
             "HTTP monitor",
             "Monitor a website.",
             1,
             "/usr/lib/nagios/plugins/check_http",
             '-I {{hostname}}{%if vhost%} -H {{vhost}}{%endif%} -f follow{%if match%} -s "{{match}}"{%endif%}{%if ssl%} -S --sni{%endif%}{%if url%} -u {{url}}{%endif%}',
             'HTTP monitor for {%if vhost%}{{vhost}}{%else%}{{hostname}}{%endif%}'
-            )
-        """,
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (2, "hostname", "Hostname of server/site", "The hostname of the site to monitor", 1, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (2, "vhost", "Virtual host", "The virtual host to monitor", 0, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (2, "match", "Match string", "Match a string in the returned site data", 0, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (2, "ssl", "Use HTTPS/SSL", "Use HTTP/SSL monitoring", 0, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (2, "url", "Url to monitor", "Monitor a specific URL", 0, "/")""",
-    """insert into active_monitor_defs
-        (name, description, active, cmdline_filename, cmdline_args_tmpl, description_tmpl) values (
+        ), (
             "HTTPS certificate monitor",
             "Monitor a websites SSL certificate.",
             1,
             "/usr/lib/nagios/plugins/check_http",
             "-I {{hostname}}{%if vhost%} -H {{vhost}}{%endif%} -C {{age}},{{age}} --sni",
             'HTTP SSL cert monitor for {%if vhost%}{{vhost}}{%else%}{{hostname}}{%endif%}'
-            )
+        )
         """,
     """insert into active_monitor_def_args
         (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (3, "hostname", "Hostname of server/site", "The hostname of the site to monitor", 1, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (3, "vhost", "Virtual host", "The virtual host to monitor", 0, "")""",
-    """insert into active_monitor_def_args
-        (active_monitor_def_id, name, display_name, description, required, default_value)
-        values (3, "age", "Certificate max age", "The max age (in days) of the site certificate", 0, "14")""",
+        values
+        (1, "hostname", "IP address", "IP to monitor", 1, ""),
+        (1, "rtt", "Max round trip time", "The maximum permitted round trip time in miliseconds", 0, "500"),
+        (1, "pl", "Max packet loss", "The maximum permitted packet loss in percent", 0, "50"),
+        (2, "hostname", "Hostname of server/site", "The hostname of the site to monitor", 1, ""),
+        (2, "vhost", "Virtual host", "The virtual host to monitor", 0, ""),
+        (2, "match", "Match string", "Match a string in the returned site data", 0, ""),
+        (2, "ssl", "Use HTTPS/SSL", "Use HTTP/SSL monitoring", 0, ""),
+        (2, "url", "Url to monitor", "Monitor a specific URL", 0, "/"),
+        (3, "hostname", "Hostname of server/site", "The hostname of the site to monitor", 1, ""),
+        (3, "vhost", "Virtual host", "The virtual host to monitor", 0, ""),
+        (3, "age", "Certificate max age", "The max age (in days) of the site certificate", 0, "14")
+        """,
 ]
 SQL_MONITORS = [
     """insert into active_monitors (def_id, state, state_ts, msg) values (1, 'UNKNOWN', 0, '')""",
@@ -301,10 +304,10 @@ SQL_MONITORS = [
 
 
 # The queries to run for an emptry database
-SQL_BARE = SQL_TABLES + SQL_VERSION
+SQL_BARE = SQL_TABLES + SQL_VERSION + SQL_INDEXES
 
 # The queries to run when adding default monitors.
-SQL_ALL = SQL_TABLES + SQL_VERSION + SQL_MONITOR_DEFS + SQL_MONITORS
+SQL_ALL = SQL_TABLES + SQL_VERSION + SQL_MONITOR_DEFS + SQL_MONITORS + SQL_INDEXES
 
 # Queries to run when upgrade the database.
 # Add a new section for each version, ie:
@@ -327,4 +330,15 @@ SQL_UPGRADES = {
     4: [
         """ALTER TABLE `active_monitors` ADD `alias` varchar(50) NULL AFTER `alerts_enabled`""",
     ],
+    5: [
+        """DROP INDEX key_value_idx""",
+        """CREATE INDEX key_value_type_id_idx ON object_metadata(key, value, object_type, object_id)""",
+    ],
+    6: [
+        """CREATE INDEX active_monitor_results_monitor_id_ts_idx ON active_monitor_results(monitor_id, timestamp)""",
+        """CREATE INDEX active_monitor_results_timestamp_idx ON active_monitor_results(timestamp)""",
+    ],
+    7: [
+        """CREATE INDEX active_monitors_deleted_id_idx ON active_monitors(deleted, id)""",
+    ],
 }
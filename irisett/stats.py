@@ -26,10 +26,10 @@ def set(var: str, value: float, section: Optional[str] = None) -> None:
     stats[var] = value
 
 
-def inc(var: str, section: Optional[str] = None) -> None:
+def inc(var: str, section: Optional[str] = None, amount: float = 1) -> None:
     """Increment a value."""
     stats = get_section(section)
-    stats[var] += 1
+    stats[var] += amount
 
 
 def dec(var: str, section: Optional[str] = None) -> None:
@@ -41,7 +41,4 @@ def dec(var: str, section: Optional[str] = None) -> None:
 def get_stats() -> Dict[str, float]:
     """Get a dict of all saved statistics."""
     global statistics
-    ret = {}  # type: Dict[str, float]
-    for k, v in statistics.items():
-        ret[k] = v
-    return ret
+    return dict(statistics)
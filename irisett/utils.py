@@ -1,6 +1,12 @@
 """Random utility functions."""
 
-from typing import Union, cast
+from typing import Any, Union, cast
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def parse_bool(string: Union[str, bool]) -> bool:
@@ -14,12 +20,23 @@ def parse_bool(string: Union[str, bool]) -> bool:
     return ret
 
 
+def json_dumps(data: Any) -> bytes:
+    """Serialize data to utf-8 encoded json.
+
+    Uses orjson if it is installed, it is a lot faster than the standard
+    library json module.
+    """
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data).encode("utf-8")
+
+
 intervals = (
-    ("weeks", 604800),  # 60 * 60 * 24 * 7
-    ("days", 86400),  # 60 * 60 * 24
-    ("hours", 3600),  # 60 * 60
-    ("minutes", 60),
-    ("seconds", 1),
+    ("weeks", "week", 604800),  # 60 * 60 * 24 * 7
+    ("days", "day", 86400),  # 60 * 60 * 24
+    ("hours", "hour", 3600),  # 60 * 60
+    ("minutes", "minute", 60),
+    ("seconds", "second", 1),
 )
 
 
@@ -29,12 +46,11 @@ def get_display_time(seconds: float, granularity: int = 2) -> str:
 
     # Avoid using floats, it makes the result ugly.
     seconds = int(seconds)
-    for name, count in intervals:
-        value = seconds // count
+    for plural, singular, count in intervals:
+        value, seconds = divmod(seconds, count)
         if value:
-            seconds -= value * count
-            if value == 1:
-                name = name.rstrip("s")
-            result.append("{} {}".format(value, name))
-    ret = ", ".join(result[:granularity])
+            result.append("%d %s" % (value, singular if value == 1 else plural))
+            if len(result) == granularity:
+                break
+    ret = ", ".join(result)
     return ret
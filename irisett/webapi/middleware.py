@@ -3,9 +3,9 @@
 Middleware for common actions, authentication etc.
 """
 
-from typing import Optional, Callable, Any
+from typing import Callable, Any, Dict, Tuple
 import base64
-import binascii
+import hmac
 from aiohttp import web
 
 from irisett import (
@@ -22,42 +22,57 @@ async def logging_middleware_factory(app: web.Application, handler: Any) -> Call
 
     async def middleware_handler(request: web.Request) -> web.Response:
         stats.inc("num_calls", "WEBAPI")
-        log.msg("Received request: %s" % request, "WEBAPI")
+        if log.msg_enabled():
+            log.msg("Received request: %s" % request, "WEBAPI")
         return await handler(request)
 
     return middleware_handler
 
 
+def make_basic_auth_header(username: str, password: str) -> bytes:
+    """Get the Authorization header value expected from clients."""
+    credentials = ("%s:%s" % (username, password)).encode("utf-8")
+    return b"Basic " + base64.b64encode(credentials)
+
+
 async def basic_auth_middleware_factory(app: web.Application, handler: Any) -> Callable:
     """Authentication.
 
     Uses HTTP basic auth to check that requests are including the required
-    username and password.
+    username and password. The Authorization header is compared to the
+    precomputed app["basic_auth_header"] in constant time.
     """
+    expected = app["basic_auth_header"]
 
     async def middleware_handler(request: web.Request) -> web.Response:
-        ok = False
-        auth_token = request.headers.get("Authorization")
-        if auth_token and auth_token.startswith("Basic "):
-            auth_token = auth_token[6:]
-            try:
-                auth_bytes = base64.b64decode(auth_token)  # type: Optional[bytes]
-            except binascii.Error:
-                auth_bytes = None
-            if auth_bytes:
-                auth_str = auth_bytes.decode("utf-8", errors="ignore")
-                if ":" in auth_str:
-                    username, password = auth_str.split(":", 1)
-                    if username == app["username"] and password == app["password"]:
-                        ok = True
-        if not ok:
-            log.msg("Unauthorized request: %s" % request, "WEBAPI")
+        auth_token = request.headers.get("Authorization", "").encode("ascii", "replace")
+        if not hmac.compare_digest(auth_token, expected):
+            if log.msg_enabled():
+                log.msg("Unauthorized request: %s" % request, "WEBAPI")
             raise errors.PermissionDenied("Unauthorized")
         return await handler(request)
 
     return middleware_handler
 
 
+# Responses for errors raised in web views, exception class: (status, default
+# message). The closest class in the exceptions mro is used.
+_ERROR_RESPONSES = {
+    errors.NotFound: (404, "not found"),
+    errors.PermissionDenied: (401, "permission denied"),
+    errors.InvalidData: (400, "invalid data"),
+    errors.WebAPIError: (400, "api error"),
+    IrisettError: (400, "irisett error"),
+}  # type: Dict[type, Tuple[int, str]]
+_HANDLED_ERRORS = tuple(_ERROR_RESPONSES)
+
+
+def _get_error_response(e: Exception) -> Tuple[int, str]:
+    return next(
+        _ERROR_RESPONSES[cls] for cls in type(e).__mro__ if cls in _ERROR_RESPONSES
+    )
+
+
 # noinspection PyUnusedLocal
 async def error_handler_middleware_factory(
     app: web.Application, handler: Any
@@ -69,32 +84,16 @@ async def error_handler_middleware_factory(
     """
 
     async def middleware_handler(request: web.Request) -> web.Response:
-        errcode = None
-        errmsg = None
-        ret = None
         try:
-            ret = await handler(request)
-        except errors.NotFound as e:
-            errcode = 404
-            errmsg = str(e) or "not found"
-        except errors.PermissionDenied as e:
-            errcode = 401
-            errmsg = str(e) or "permission denied"
-        except errors.InvalidData as e:
-            errcode = 400
-            errmsg = str(e) or "invalid data"
-        except errors.WebAPIError as e:
-            errcode = 400
-            errmsg = str(e) or "api error"
-        except IrisettError as e:
-            errcode = 400
-            errmsg = str(e) or "irisett error"
-        if errcode:
+            return await handler(request)
+        except _HANDLED_ERRORS as e:
+            errcode, default_errmsg = _get_error_response(e)
+            errmsg = str(e) or default_errmsg
+        if log.msg_enabled():
             log.msg(
                 "Request returning error(%d/%s): %s" % (errcode, errmsg, request),
                 "WEBAPI",
             )
-            ret = web.Response(status=errcode, text=errmsg)
-        return ret
+        return web.Response(status=errcode, text=errmsg)
 
     return middleware_handler
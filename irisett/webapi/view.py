@@ -109,21 +109,18 @@ class ActiveMonitorView(web.View):
         elif "meta_key" in self.request.rel_url.query:
             meta_key = require_str(get_request_param(self.request, "meta_key"))
             meta_value = require_str(get_request_param(self.request, "meta_value"))
-            active_monitor_models = await active_sql.get_active_monitors_for_metadata(
+            ids = await active_sql.get_active_monitor_ids_for_metadata(
                 dbcon, meta_key, meta_value
             )
-            ids = [monitor.id for monitor in active_monitor_models]
         elif "monitor_group_id" in self.request.rel_url.query:
             monitor_group_id = require_int(
                 get_request_param(self.request, "monitor_group_id")
             )
-            active_monitor_models = await monitor_group.get_active_monitors_for_monitor_group(
+            ids = await monitor_group.get_active_monitor_ids_for_monitor_group(
                 dbcon, monitor_group_id
             )
-            ids = [monitor.id for monitor in active_monitor_models]
         else:
-            active_monitor_models = await active_sql.get_all_active_monitors(dbcon)
-            ids = [monitor.id for monitor in active_monitor_models]
+            ids = await active_sql.get_all_active_monitor_ids(dbcon)
         return ids
 
     async def _get_monitor_metadata(
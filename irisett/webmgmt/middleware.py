@@ -3,9 +3,9 @@
 Middleware for common actions, authentication etc.
 """
 
-from typing import Optional, Callable, Any
+from typing import Callable, Any, Dict, Tuple
 import base64
-import binascii
+import hmac
 from aiohttp import web
 
 from irisett import (
@@ -22,42 +22,62 @@ async def logging_middleware_factory(app: web.Application, handler: Any) -> Call
 
     async def middleware_handler(request: web.Request) -> web.Response:
         stats.inc("num_calls", "WEBMGMT")
-        log.msg("Received request: %s" % request, "WEBMGMT")
+        if log.msg_enabled():
+            log.msg("Received request: %s" % request, "WEBMGMT")
         return await handler(request)
 
     return middleware_handler
 
 
+def make_basic_auth_header(username: str, password: str) -> bytes:
+    """Get the Authorization header value expected from clients."""
+    credentials = ("%s:%s" % (username, password)).encode("utf-8")
+    return b"Basic " + base64.b64encode(credentials)
+
+
 async def basic_auth_middleware_factory(app: web.Application, handler: Any) -> Callable:
     """Authentication.
 
     Uses HTTP basic auth to check that requests are including the required
-    username and password.
+    username and password. The Authorization header is compared to the
+    precomputed app["basic_auth_header"] in constant time.
     """
+    expected = app["basic_auth_header"]
 
     async def middleware_handler(request: web.Request) -> web.Response:
-        ok = False
-        auth_token = request.headers.get("Authorization")
-        if auth_token and auth_token.startswith("Basic "):
-            auth_token = auth_token[6:]
-            try:
-                auth_bytes = base64.b64decode(auth_token)  # type: Optional[bytes]
-            except binascii.Error:
-                auth_bytes = None
-            if auth_bytes:
-                auth_str = auth_bytes.decode("utf-8", errors="ignore")
-                if ":" in auth_str:
-                    username, password = auth_str.split(":", 1)
-                    if username == app["username"] and password == app["password"]:
-                        ok = True
-        if not ok:
-            log.msg("Unauthorized request: %s" % request, "WEBMGMT")
+        auth_token = request.headers.get("Authorization", "").encode("ascii", "replace")
+        if not hmac.compare_digest(auth_token, expected):
+            if log.msg_enabled():
+                log.msg("Unauthorized request: %s" % request, "WEBMGMT")
             raise errors.MissingLogin("Unauthorized")
         return await handler(request)
 
     return middleware_handler
 
 
+# Responses for errors raised in web views, exception class: (status, default
+# message, extra headers). The closest class in the exceptions mro is used.
+_ERROR_RESPONSES = {
+    errors.NotFound: (404, "not found", {}),
+    errors.PermissionDenied: (401, "permission denied", {}),
+    errors.MissingLogin: (
+        401,
+        "permission denied",
+        {"WWW-Authenticate": 'Basic realm="Restricted"'},
+    ),
+    errors.InvalidData: (400, "invalid data", {}),
+    errors.WebMgmtError: (400, "web error", {}),
+    IrisettError: (400, "irisett error", {}),
+}  # type: Dict[type, Tuple[int, str, Dict[str, str]]]
+_HANDLED_ERRORS = tuple(_ERROR_RESPONSES)
+
+
+def _get_error_response(e: Exception) -> Tuple[int, str, Dict[str, str]]:
+    return next(
+        _ERROR_RESPONSES[cls] for cls in type(e).__mro__ if cls in _ERROR_RESPONSES
+    )
+
+
 # noinspection PyUnusedLocal
 async def error_handler_middleware_factory(
     app: web.Application, handler: Any
@@ -69,37 +89,16 @@ async def error_handler_middleware_factory(
     """
 
     async def middleware_handler(request: web.Request) -> web.Response:
-        errcode = None
-        errmsg = None
-        ret = None
-        headers = {}
         try:
-            ret = await handler(request)
-        except errors.NotFound as e:
-            errcode = 404
-            errmsg = str(e) or "not found"
-        except errors.PermissionDenied as e:
-            errcode = 401
-            errmsg = str(e) or "permission denied"
-        except errors.MissingLogin as e:
-            errcode = 401
-            errmsg = str(e) or "permission denied"
-            headers["WWW-Authenticate"] = 'Basic realm="Restricted"'
-        except errors.InvalidData as e:
-            errcode = 400
-            errmsg = str(e) or "invalid data"
-        except errors.WebMgmtError as e:
-            errcode = 400
-            errmsg = str(e) or "web error"
-        except IrisettError as e:
-            errcode = 400
-            errmsg = str(e) or "irisett error"
-        if errcode:
+            return await handler(request)
+        except _HANDLED_ERRORS as e:
+            errcode, default_errmsg, headers = _get_error_response(e)
+            errmsg = str(e) or default_errmsg
+        if log.msg_enabled():
             log.msg(
                 "Request returning error(%d/%s): %s" % (errcode, errmsg, request),
                 "WEBMGMT",
             )
-            ret = web.Response(status=errcode, text=errmsg, headers=headers)
-        return ret
+        return web.Response(status=errcode, text=errmsg, headers=headers)
 
     return middleware_handler
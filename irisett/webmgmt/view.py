@@ -1,13 +1,12 @@
 """Web views."""
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Iterable
 import time
 from aiohttp import web
 
 # noinspection PyPackageRequirements
 import aiohttp_jinja2
 
-from irisett.sql import DBConnection
 from irisett import (
     metadata,
     stats,
@@ -319,28 +318,24 @@ class DisplayMonitorGroupView(web.View):
         )
         if not mg:
             raise errors.NotFound()
+        contacts, contact_groups, sql_monitors = await monitor_group.get_monitor_group_bundle(
+            dbcon, mg.id
+        )
         context = {
             "section": "monitor_group",
             "monitor_group": mg,
-            "contacts": await monitor_group.get_contacts_for_monitor_group(
-                dbcon, mg.id
-            ),
-            "contact_groups": await monitor_group.get_contact_groups_for_monitor_group(
-                dbcon, mg.id
-            ),
-            "active_monitors": await self._get_active_monitors(dbcon, mg.id),
+            "contacts": contacts,
+            "contact_groups": contact_groups,
+            "active_monitors": self._get_active_monitors(sql_monitors),
             "metadata": await metadata.get_metadata_for_object(
                 self.request.app["dbcon"], "monitor_group", mg.id
             ),
         }
         return context
 
-    async def _get_active_monitors(
-        self, dbcon: DBConnection, monitor_group_id: int
+    def _get_active_monitors(
+        self, sql_monitors: Iterable[object_models.ActiveMonitor]
     ) -> List[object_models.ActiveMonitor]:
-        sql_monitors = await monitor_group.get_active_monitors_for_monitor_group(
-            dbcon, monitor_group_id
-        )
         am_manager = self.request.app["active_monitor_manager"]
         monitors = [
             am_manager.monitors[m.id]
@@ -74,8 +74,7 @@ def initialize(
             middleware.basic_auth_middleware_factory,
         ],
     )
-    app["username"] = username
-    app["password"] = password
+    app["basic_auth_header"] = middleware.make_basic_auth_header(username, password)
     app["dbcon"] = dbcon
     app["active_monitor_manager"] = active_monitor_manager
     setup_routes(app)
@@ -1,7 +1,7 @@
 import sys
 
-if sys.version_info < (3, 5, 0):
-    sys.stderr.write("ERROR: You need Python 3.5 or later to use Irisett.\n")
+if sys.version_info < (3, 6, 0):
+    sys.stderr.write("ERROR: You need Python 3.6 or later to use Irisett.\n")
     exit(1)
 
 from setuptools import setup
@@ -62,6 +62,6 @@ setup(
         'Topic :: System :: Monitoring',
         'Topic :: System :: Networking :: Monitoring',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.6',
     ],
 )
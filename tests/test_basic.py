@@ -3,12 +3,13 @@ import pytest
 import asyncio
 from irisett.sql import DBConnection
 from irisett.notify.manager import NotificationManager
-from irisett.monitor import active_sql
+from irisett.monitor import active_sql, active
 from irisett import (
     object_models,
     contact,
     monitor_group,
-    metadata
+    metadata,
+    nagios,
 )
 from sqlsetup import get_dbcon
 
@@ -99,3 +100,60 @@ async def test_metadata_basic():
     await metadata.delete_metadata(dbcon, 'test', 1)
     res = await metadata.get_metadata(dbcon, 'test', 1)
     assert res == {}
+
+
+def test_compile_template():
+    """Simple and jinja monitor def templates expand the same way."""
+    args = {'hostname': '127.0.0.1', 'rtt': 500}
+    render = active.compile_template('-H {{hostname}} -w {{ rtt }},{{missing}}')
+    assert render(args) == '-H 127.0.0.1 -w 500,'
+    render = active.compile_template('-H {{hostname}}{%if vhost%} -V {{vhost}}{%endif%}')
+    assert render(args) == '-H 127.0.0.1'
+
+
+def test_parse_plugin_output_text_only():
+    """A single line of output without performance data."""
+    text, perf = nagios.parse_plugin_output(b'PING OK - Packet loss = 0%\n')
+    assert text == 'PING OK - Packet loss = 0%'
+    assert perf == []
+
+
+def test_parse_plugin_output_first_line_perf():
+    """Performance data on the first line is split from the text."""
+    text, perf = nagios.parse_plugin_output(
+        b'PING OK - Packet loss = 0%, RTA = 0.80 ms|percent_packet_loss=0, rta=0.80\n')
+    assert text == 'PING OK - Packet loss = 0%, RTA = 0.80 ms'
+    assert perf == [b'percent_packet_loss=0, rta=0.80']
+
+
+def test_parse_plugin_output_long_text():
+    """Long text lines are appended to the text."""
+    text, perf = nagios.parse_plugin_output(
+        b'DISK OK - free space: / 3326 MB (56%);\n/ 15272 MB (77%);\n/boot 68 MB (69%);\n')
+    assert text == 'DISK OK - free space: / 3326 MB (56%);\n/ 15272 MB (77%);\n/boot 68 MB (69%);'
+    assert perf == []
+
+
+def test_parse_plugin_output_trailing_perf():
+    """Performance data after the long text, example from the plugin api docs."""
+    output = (
+        b'DISK OK - free space: / 3326 MB (56%); | /=2643MB;5948;5958;0;5968\n'
+        b'/ 15272 MB (77%);\n'
+        b'/boot 68 MB (69%);\n'
+        b'/var/log 819 MB (84%); | /boot=68MB;88;93;0;98\n'
+        b'/home=69357MB;253404;253409;0;253414 \n'
+        b'/var/log=818MB;970;975;0;980\n'
+    )
+    text, perf = nagios.parse_plugin_output(output)
+    assert text == (
+        'DISK OK - free space: / 3326 MB (56%);\n'
+        '/ 15272 MB (77%);\n'
+        '/boot 68 MB (69%);\n'
+        '/var/log 819 MB (84%);'
+    )
+    assert perf == [
+        b'/=2643MB;5948;5958;0;5968',
+        b'/boot=68MB;88;93;0;98',
+        b'/home=69357MB;253404;253409;0;253414',
+        b'/var/log=818MB;970;975;0;980',
+    ]